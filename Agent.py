@@ -1,14 +1,18 @@
 #!/usr/bin/env python
 __author__ = 'jesse'
 
+import collections
 import copy
 import math
+import multiprocessing
 import numpy as np
 import operator
 import os
 import pickle
 import random
 import signal
+import tempfile
+import time
 
 
 class Agent:
@@ -22,7 +26,9 @@ class Agent:
                  use_shorter_utterances=False,  # useful for rendering speech on robot
                  word_neighbors_to_consider_as_synonyms=3,  # how many lexicon items to beam through for new pred
                  max_perception_subdialog_qs=3,  # based on CORL17 control condition; vetted down from 5
-                 max_ask_before_enumeration=2):  # max times to ask the same question before using an enumeration backoff
+                 max_ask_before_enumeration=2,  # max times to ask the same question before using an enumeration backoff
+                 parses_to_ground=1,  # how many of the parser's best parses of an utterance to ground
+                 grounding_workers=1):  # processes to ground those parses concurrently across
         # random.seed(27)  # (adj for demo)
         # np.random.seed(seed=27)  # (adj for demo)
         self.parser = parser
@@ -40,9 +46,12 @@ class Agent:
         self.none_start_mass_factor = 1  # how much None mass per role versus all else; if 1, 50/50, if 9, 9 None to 1 else
         self.max_perception_subdialog_qs = max_perception_subdialog_qs
         self.max_ask_before_enumeration = max_ask_before_enumeration
+        self.parses_to_ground = parses_to_ground
+        self.grounding_workers = grounding_workers
         self.word_neighbors_to_consider_as_synonyms = word_neighbors_to_consider_as_synonyms
         self.budget_for_parsing = 15  # how many seconds we allow the parser
         self.budget_for_grounding = 10  # how many seconds we allow the grounder
+        self.grounding_timeout_k = 10  # how many of the most confident groundings found to keep on grounding timeout
         self.latent_forms_to_consider_for_induction = 32  # maximum parses to consider for grounding during induction
         # self.get_novel_question_beam = 10  # how many times to sample for a new question before giving up if identical
 
@@ -69,6 +78,20 @@ class Agent:
         self.parser_timeouts = 0
         self.grounder_timeouts = 0
 
+        # worker processes holding a copy of the grounder, the KB version and ontology size workers should ground
+        # against, and the file of KB state they refresh their copy from when it is older than that
+        self.grounding_pool = None
+        self.grounding_pool_version = None
+        self.grounding_state_fn = None
+
+    # Pickle everything but the grounding worker pool, which is recreated on demand.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['grounding_pool'] = None
+        state['grounding_pool_version'] = None
+        state['grounding_state_fn'] = None
+        return state
+
     # Start a new action dialog from utterance u given by a user.
     # Clarifies the arguments of u until the action is confirmed by the user.
     # perception_labels_requested - pairs of (pidx, oidx) labels already requested from user; modified in-place.
@@ -295,6 +318,10 @@ class Agent:
         if perform_action:
             self.io.perform_action(action_confirmed)
 
+        # Now that the user isn't waiting on a question, fully refit any classifiers updated online during the dialog.
+        self.grounder.kb.pc.flush_pending_retrains()
+        self.close_grounding_pool()
+
         # Return the chosen action and the user utterances by role from this dialog.
         return action_confirmed, user_utterances_by_role, self.parser_timeouts, self.grounder_timeouts
 
@@ -355,7 +382,12 @@ class Agent:
                     if len(preds_to_consider) == 0:  # no further preds to consider
                         return num_qs
                     pred_to_surface = {}
-                    for pred in preds_to_consider:
+                    test_confs = self.grounder.kb.query_perceptual_batch(preds_to_consider,
+                                                                          self.grounder.active_test_set)
+                    train_confs = self.grounder.kb.query_perceptual_batch(preds_to_consider,
+                                                                           self.active_train_set)
+                    for pred_idx in range(len(preds_to_consider)):
+                        pred = preds_to_consider[pred_idx]
                         pidx = self.grounder.kb.pc.predicates.index(pred)
 
                         # Calculate the surface form to use with this pred.
@@ -375,15 +407,16 @@ class Agent:
                             sfs_with_sems[sf_sem_scores.index(best_sf_sem_score)][0]]
 
                         test_conf = 0
-                        for oidx in self.grounder.active_test_set:
-                            pos_conf, neg_conf = self.grounder.kb.query((pred, 'oidx_' + str(oidx)))
+                        for oidx_idx in range(len(self.grounder.active_test_set)):
+                            pos_conf, neg_conf = test_confs[pred_idx, oidx_idx]
                             test_conf += max(pos_conf, neg_conf)
                         pred_test_conf[pred] = test_conf / len(self.grounder.active_test_set)
 
                         pred_train_conf[pred] = []
-                        for oidx in self.active_train_set:
+                        for oidx_idx in range(len(self.active_train_set)):
+                            oidx = self.active_train_set[oidx_idx]
                             if (pidx, oidx) not in labeled_tuples:
-                                pos_conf, neg_conf = self.grounder.kb.query((pred, 'oidx_' + str(oidx)))
+                                pos_conf, neg_conf = train_confs[pred_idx, oidx_idx]
                                 pred_train_conf[pred].append(max(pos_conf, neg_conf))
                                 if pred_train_conf[pred][-1] < 0:
                                     pred_train_conf[pred][-1] = 0.
@@ -431,9 +464,8 @@ class Agent:
 
                             # If all objects are below the perception threshold, ask for label we have least of.
                             if min(pred_train_conf[pred]) < self.threshold_to_accept_perceptual_conf:
-                                ls = [l for _p, _o, l in self.grounder.kb.pc.labels if _p == perception_pidx
-                                      and _o not in self.grounder.active_test_set]
-                                if ls.count(1) <= ls.count(0):  # more negative labels or labels are equal
+                                neg_count, pos_count = self.grounder.kb.pc.get_label_counts(perception_pidx)
+                                if pos_count <= neg_count:  # more negative labels or labels are equal
                                     if self.use_shorter_utterances:
                                         q = ("Show me an object you could use the word '" + pred_to_surface[pred] +
                                              "' when describing, or shake your head.")
@@ -1080,16 +1112,17 @@ class Agent:
         return pairs
 
     # Parse and ground a given utterance.
+    # Up to parses_to_ground of the parser's best parses are grounded, and their groundings are returned with
+    # confidences weighted by the parser's relative confidence in each parse; the best parse is returned with them.
+    # All the parses are found within one budget_for_parsing, and the utterance counts once among the
+    # parser_timeouts if the parser timed out or the budget ran out before parses_to_ground parses were found.
     def parse_and_ground_utterance(self, u):
         debug = False
 
-        # TODO: do probabilistic updates by normalizing the parser outputs in a beam instead of only considering top-1
-        # TODO: confidence could be propagated through the confidence values returned by the grounder, such that
-        # TODO: this function returns tuples of (grounded parse, parser conf * grounder conf)
+        parse_deadline = time.time() + self.budget_for_parsing if self.budget_for_parsing is not None else None
         parse_generator = self.parser.most_likely_cky_parse(u, reranker_beam=self.parse_beam, timeout=self.budget_for_parsing)
         cgtr = next(parse_generator)
-        if self.parser.parsing_timeout_on_last_parse:
-            self.parser_timeouts += 1
+        parse_timed_out = self.parser.parsing_timeout_on_last_parse
         p = None
         if cgtr is not None and cgtr[0] is not None:
             p = cgtr[0]  # most_likely_cky_parse returns a 4-tuple, the first of which is the parsenode
@@ -1097,21 +1130,56 @@ class Agent:
                 print("parse_and_ground_utterance: parsed '" + u + "' to " + self.parser.print_parse(p.node))
 
             # Get semantic trees with hanging lambdas instantiated.
-            gn = self.ground_semantic_form(p.node)
+            if self.parses_to_ground > 1:
+                parses = [(cgtr[0], cgtr[1])]  # parse node and score, a log probability
+                while len(parses) < self.parses_to_ground and not parse_timed_out:
+                    if parse_deadline is not None:
+                        remaining = parse_deadline - time.time()
+                        if remaining <= 0:
+                            parse_timed_out = True
+                            break
+                        # the generator's own timeout restarts with every parse, so bound each by what remains
+                        r = self.call_function_with_timeout(lambda g: [next(g)], {'g': parse_generator},
+                                                            int(math.ceil(remaining)))
+                        if r is None:
+                            parse_timed_out = True
+                            break
+                        cgtr = r[0]
+                        parse_timed_out = self.parser.parsing_timeout_on_last_parse
+                    else:
+                        cgtr = next(parse_generator)
+                    if cgtr is None or cgtr[0] is None:
+                        break
+                    parses.append((cgtr[0], cgtr[1]))
+                    if debug:
+                        print("parse_and_ground_utterance: ... and to " + self.parser.print_parse(cgtr[0].node))
+                gn = self.ground_semantic_forms([parse.node for parse, _ in parses], [score for _, score in parses])
+            else:
+                gn = self.ground_semantic_form(p.node)
 
         else:
             if debug:
                 print("parse_and_ground_utterance: could not generate a parse for the utterance")
             gn = []
+        if parse_timed_out:
+            self.parser_timeouts += 1
 
         return gn, p
 
     # Ground semantic form.
+    # Grounding is cooperative: past budget_for_grounding, the grounder stops expanding and the grounding_timeout_k
+    # most confident groundings it found by then, possibly none, are used; the turn is counted among the
+    # grounder_timeouts.
     def ground_semantic_form(self, s):
         debug = False
 
-        gs = self.call_function_with_timeout(self.grounder.ground_semantic_tree, {"root": s},
-                                             self.budget_for_parsing)
+        deadline = time.time() + self.budget_for_grounding if self.budget_for_grounding is not None else None
+        gs = self.grounder.ground_semantic_tree(s, deadline=deadline, k=self.grounding_timeout_k)
+        if self.grounder.last_grounding_memo_stats['timed_out']:
+            self.grounder_timeouts += 1
+            if debug:
+                print("ground_semantic_form: grounding timeout for " + self.parser.print_parse(s) + "; keeping " +
+                      str(len(gs) if gs is not None else 0) + " groundings found")
         if gs is not None:
             # normalize grounding confidences such that they sum to one and return pairs of grounding, conf
             gn = self.sort_groundings_by_conf(gs)
@@ -1122,12 +1190,96 @@ class Agent:
                                             for t, c in gn]))
         else:
             gn = []
-            if debug:
-                print("ground_semantic_form: grounding timeout for " + self.parser.print_parse(s))
+
+        return gn
+
+    # Ground several semantic forms, e.g. the parser's best parses of an utterance, given the parser's log probability
+    # scores for them.
+    # Forms are grounded concurrently if there are grounding_workers, each within budget_for_grounding. Returns
+    # groundings and confidences in sorted order as ground_semantic_form does, with the confidences of each form's
+    # groundings weighted by its share of the parser's probability over the forms and summed across forms that
+    # ground to the same thing.
+    def ground_semantic_forms(self, forms, scores):
+        debug = False
+
+        deadline = time.time() + self.budget_for_grounding if self.budget_for_grounding is not None else None
+        if self.grounding_workers > 1 and len(forms) > 1:
+            pool = self.get_grounding_pool()
+            results = pool.map(ground_semantic_form_in_worker,
+                               [self.get_grounding_task(s, deadline, self.grounding_timeout_k) for s in forms])
+        else:
+            results = []
+            for s in forms:
+                gs = self.grounder.ground_semantic_tree(s, deadline=deadline, k=self.grounding_timeout_k)
+                results.append((gs, self.grounder.last_grounding_memo_stats['timed_out']))
+        if True in [timed_out for _, timed_out in results]:
             self.grounder_timeouts += 1
 
+        weights = np.exp(np.array(scores, dtype=float) - max(scores))
+        weights /= np.sum(weights)
+        combined = {}  # from grounding strs to [grounding, summed confidence]
+        for idx in range(len(forms)):
+            gs = results[idx][0]
+            if gs is None or len(gs) == 0:
+                continue
+            for t, c in self.sort_groundings_by_conf(gs):
+                key = str(t) if type(t) is bool else self.parser.print_parse(t)
+                if key not in combined:
+                    combined[key] = [t, 0.0]
+                combined[key][1] += float(weights[idx]) * c
+        gn = sorted([(t, c) for t, c in combined.values()], key=lambda x: x[1], reverse=True)
+        if debug:
+            print ("ground_semantic_forms: resulting groundings with parse-weighted confidences: " +
+                   "\n\t" + "\n\t".join([" ".join([str(t) if type(t) is bool else self.parser.print_parse(t),
+                                                   str(c)])
+                                        for t, c in gn]))
+
         return gn
 
+    # Returns a pool of grounding_workers processes that each hold a copy of the grounder, made when first needed.
+    # Workers are not re-forked when the KB or ontology changes (e.g., with every perception label); instead the
+    # grounder's KB state is written out once per change, and each worker reloads it before its next task, so
+    # workers never ground against stale facts, classifiers, or vocabulary.
+    def get_grounding_pool(self):
+        version = (self.grounder.kb.get_version(), len(self.parser.ontology.preds))
+        if self.grounding_pool is None:
+            self.grounding_pool = multiprocessing.Pool(processes=self.grounding_workers,
+                                                       initializer=init_grounding_worker,
+                                                       initargs=(self.grounder, version))
+            self.grounding_pool_version = version
+        elif self.grounding_pool_version != version:
+            self.write_grounding_state(version)
+        return self.grounding_pool
+
+    # Write the KB state and ontology workers need to ground at the given version to a fresh grounding_state_fn,
+    # removing the last one. Perception features never change, so they are left out; workers keep their own.
+    def write_grounding_state(self, version):
+        kb = copy.copy(self.grounder.kb)
+        kb.pc = copy.copy(kb.pc)
+        kb.pc.features = None
+        fd, fn = tempfile.mkstemp(suffix=".grounding_state.pickle")
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump([kb, self.parser.ontology], f)
+        if self.grounding_state_fn is not None:
+            os.remove(self.grounding_state_fn)
+        self.grounding_state_fn = fn
+        self.grounding_pool_version = version
+
+    # Returns the task for a grounding worker to ground semantic form s; see ground_semantic_form_in_worker.
+    def get_grounding_task(self, s, deadline, k):
+        return s, deadline, k, self.grounding_pool_version, self.grounding_state_fn
+
+    # Closes the grounding pool, if there is one, and removes the KB state written for its workers.
+    def close_grounding_pool(self):
+        if self.grounding_pool is not None:
+            self.grounding_pool.close()
+            self.grounding_pool.join()
+            self.grounding_pool = None
+            self.grounding_pool_version = None
+        if self.grounding_state_fn is not None:
+            os.remove(self.grounding_state_fn)
+            self.grounding_state_fn = None
+
     # Given a set of groundings, return them and their confidences in sorted order.
     def sort_groundings_by_conf(self, gs):
         s = sum([c for _, _, c in gs])
@@ -1551,8 +1703,13 @@ class Agent:
 
     # Given the current set of utterance/grounding pairs, return pairs of utterance/semantics
     # based on parsing in beams and searching for parses that yield correct grounding.
+    # Pairs can be distributed over the UT Condor system (use_condor) or over a local pool of induction_workers
+    # processes, where each pair gets induction_pair_timeout seconds (by default, the condor jobs' 10 minutes; None
+    # for no limit) and induction_pair_retries retries.
     def get_semantic_forms_for_induced_pairs(self, parse_reranker_beam, interpolation_reranker_beam, verbose=0,
-                                             use_condor=False, condor_target_dir=None, condor_script_dir=None):
+                                             use_condor=False, condor_target_dir=None, condor_script_dir=None,
+                                             induction_workers=1, induction_pair_timeout=600,
+                                             induction_pair_retries=1):
 
         if use_condor:
             agent_fn = os.path.join(condor_target_dir, "temp.agent.pickle")
@@ -1578,103 +1735,239 @@ class Agent:
             os.system("rm " + agent_fn)
             os.system("rm " + pairs_in_fn)
             os.system("rm " + pairs_out_fn)
+            utterance_semantic_pairs = self.read_raw_induced_pairs(raw_pairs)
 
-            # Since we distributed the computation, we need to update the local Ontology with any new types
-            # that were introduced by weird 'and' rules in the pairs.
-            # We do this by getting sem forms as strings, so we need to read them in afresh now.
-            utterance_semantic_pairs = []
-            for s, sem_str, g in raw_pairs:
-                ccg_str, form_str = sem_str.split(" : ")
-                ccg = self.parser.lexicon.read_category_from_str(ccg_str)
-                form = self.parser.lexicon.read_semantic_form_from_str(form_str, None, None, [])
-                form.category = ccg
-                utterance_semantic_pairs.append([s, form, g])
+        elif induction_workers > 1:
+            raw_pairs = self.get_raw_semantic_forms_for_induced_pairs_in_pool(
+                parse_reranker_beam, interpolation_reranker_beam, verbose, induction_workers,
+                induction_pair_timeout, induction_pair_retries)
+            utterance_semantic_pairs = self.read_raw_induced_pairs(raw_pairs)
 
         else:
 
             # Induce utterance/semantic form pairs from utterance/grounding pairs.
             utterance_semantic_pairs = []
             for [x, g] in self.induced_utterance_grounding_pairs:
-                if verbose > 0:
-                    print ("get_semantic_forms_for_induced_pairs: looking for semantic forms for x '" + str(x) +
-                           "' with grounding " + self.parser.print_parse(g))
-
-                parses = []
-                # no timeouts during induction/training; allow parser to wear itself out looking for solutions
-                cky_parse_generator = self.parser.most_likely_cky_parse(x, reranker_beam=parse_reranker_beam,
-                                                                        debug=False, timeout=None)
-                cgtr = next(cky_parse_generator)
-                parse = None
-                if cgtr is not None:
-                    parse = cgtr[0]
-                    score = cgtr[1]  # most_likely_cky_parse returns a 4-tuple headed by the parsenode and score
-                latent_forms_considered = 1
-                while (parse is not None and len(parses) < interpolation_reranker_beam and
-                       latent_forms_considered < self.latent_forms_to_consider_for_induction):
-
-                    if verbose > 2:
-                        print ("get_semantic_forms_for_induced_pairs: ... grounding semantic form " +
-                               self.parser.print_parse(parse.node, True) + " with scores p " + str(score))
-                    # Allow grounder to run indefinitely at training time.
-                    gs = self.grounder.ground_semantic_tree(parse.node)
-                    if gs is not None:
-                        gn = self.sort_groundings_by_conf(gs)
-                    else:
-                        gn = []
-                    if len(gn) > 0:
-                        for gz, g_score in gn:
-                            print ("get_semantic_forms_for_induced_pairs: ...... form grounded to " +
-                                   str(self.parser.print_parse(gz) if type(gz) is not bool else str(gz)) +
-                                   " with score " + str(g_score))
-                            if ((type(gz) is bool and gz == g) or
-                                    (type(gz) is not bool and g.equal_allowing_commutativity(gz, self.parser.ontology))):
-                                parses.append([parse, score + math.log(g_score + 1.0)])  # add 1 for zero probabilities
-                                print ("get_semantic_forms_for_induced_pairs: ... found semantic form " +
-                                       self.parser.print_parse(parse.node, True) +
-                                       " with scores p " + str(score) + ", g " + str(g_score))
-                                break
+                utterance_semantic_pairs.extend(self.get_semantic_forms_for_induced_pair(
+                    x, g, parse_reranker_beam, interpolation_reranker_beam, verbose))
+
+        return utterance_semantic_pairs
+
+    # Given an utterance x and its induced grounding g, return utterance/semantic form/grounding triples for it:
+    # the best parse of x whose interpolated parse and grounding score is highest among those grounding to g or,
+    # failing that, a possible synonymy pair for each category of a lexical entry matching g.
+    def get_semantic_forms_for_induced_pair(self, x, g, parse_reranker_beam, interpolation_reranker_beam, verbose=0):
+        if verbose > 0:
+            print ("get_semantic_forms_for_induced_pairs: looking for semantic forms for x '" + str(x) +
+                   "' with grounding " + self.parser.print_parse(g))
+
+        pairs = []
+        parses = []
+        # no timeouts during induction/training; allow parser to wear itself out looking for solutions
+        cky_parse_generator = self.parser.most_likely_cky_parse(x, reranker_beam=parse_reranker_beam,
+                                                                debug=False, timeout=None)
+        if self.grounding_workers > 1:
+            parses = self.get_grounding_matched_parses_pipelined(cky_parse_generator, g,
+                                                                 interpolation_reranker_beam, verbose)
+            cgtr = None
+        else:
+            cgtr = next(cky_parse_generator)
+        parse = None
+        if cgtr is not None:
+            parse = cgtr[0]
+            score = cgtr[1]  # most_likely_cky_parse returns a 4-tuple headed by the parsenode and score
+        latent_forms_considered = 1
+        while (parse is not None and len(parses) < interpolation_reranker_beam and
+               latent_forms_considered < self.latent_forms_to_consider_for_induction):
+
+            if verbose > 2:
+                print ("get_semantic_forms_for_induced_pairs: ... grounding semantic form " +
+                       self.parser.print_parse(parse.node, True) + " with scores p " + str(score))
+            # Allow grounder to run indefinitely at training time.
+            gs = self.grounder.ground_semantic_tree(parse.node)
+            match = self.get_grounding_matched_parse(parse, score, gs, g)
+            if match is not None:
+                parses.append(match)
+
+            cgtr = next(cky_parse_generator)
+            parse = None
+            if cgtr is not None:
+                parse = cgtr[0]
+                score = cgtr[1]
+
+            latent_forms_considered += 1
+
+        if len(parses) > 0:
+            sorted_interpolation = sorted(parses, key=lambda t: t[1], reverse=True)
+            best_interpolated_parses = [parse for parse, score in sorted_interpolation
+                                        if np.isclose(score, sorted_interpolation[0][1])]
+            best_interpolated_parse = random.choice(best_interpolated_parses)
+            pairs.append([x, best_interpolated_parse.node, g])
+            print("... re-ranked to choose " + self.parser.print_parse(best_interpolated_parse.node))
+            best_interpolated_parse.node.commutative_lower_node(self.parser.ontology)
+            print("... commutative lowered to " + self.parser.print_parse(best_interpolated_parse.node))
+        elif len(self.parser.tokenize(x)) <= self.parser.max_multiword_expression:
+            # Find the categories of entries in lexicon, if any, matching g.
+            matching_categories = []
+            for surface_idx in range(len(self.parser.lexicon.surface_forms)):
+                for sem_idx in self.parser.lexicon.entries[surface_idx]:
+                    if g.equal_allowing_commutativity(self.parser.lexicon.semantic_forms[sem_idx],
+                                                      self.parser.ontology, ignore_syntax=True):
+                        matching_categories.append(self.parser.lexicon.semantic_forms[sem_idx].category)
+            if len(matching_categories) > 0:
+                for c in matching_categories:
+                    print ("get_semantic_forms_for_induced_pairs: no semantic parse found; adding " +
+                           "possible synonymy pair " + "'" + str(x) + "' with " +
+                           self.parser.lexicon.compose_str_from_category(c) + " : " +
+                           self.parser.print_parse(g))
+                    parse = copy.deepcopy(g)
+                    parse.category = c
+                    pairs.append([x, parse, g])
+        elif verbose > 0:
+            print ("get_semantic_forms_for_induced_pairs: no semantic parse found matching " +
+                   "grounding for pair '" + str(x) + "', " + self.parser.print_parse(g))
 
-                    cgtr = next(cky_parse_generator)
-                    parse = None
-                    if cgtr is not None:
-                        parse = cgtr[0]
-                        score = cgtr[1]
-
-                    latent_forms_considered += 1
-
-                if len(parses) > 0:
-                    sorted_interpolation = sorted(parses, key=lambda t: t[1], reverse=True)
-                    best_interpolated_parses = [parse for parse, score in sorted_interpolation
-                                                if np.isclose(score, sorted_interpolation[0][1])]
-                    best_interpolated_parse = random.choice(best_interpolated_parses)
-                    utterance_semantic_pairs.append([x, best_interpolated_parse.node, g])
-                    print("... re-ranked to choose " + self.parser.print_parse(best_interpolated_parse.node))
-                    best_interpolated_parse.node.commutative_lower_node(self.parser.ontology)
-                    print("... commutative lowered to " + self.parser.print_parse(best_interpolated_parse.node))
-                elif len(self.parser.tokenize(x)) <= self.parser.max_multiword_expression:
-                    # Find the categories of entries in lexicon, if any, matching g.
-                    matching_categories = []
-                    for surface_idx in range(len(self.parser.lexicon.surface_forms)):
-                        for sem_idx in self.parser.lexicon.entries[surface_idx]:
-                            if g.equal_allowing_commutativity(self.parser.lexicon.semantic_forms[sem_idx],
-                                                              self.parser.ontology, ignore_syntax=True):
-                                matching_categories.append(self.parser.lexicon.semantic_forms[sem_idx].category)
-                    if len(matching_categories) > 0:
-                        utterance_semantic_pairs = []
-                        for c in matching_categories:
-                            print ("get_semantic_forms_for_induced_pairs: no semantic parse found; adding " +
-                                   "possible synonymy pair " + "'" + str(x) + "' with " +
-                                   self.parser.lexicon.compose_str_from_category(c) + " : " +
-                                   self.parser.print_parse(g))
-                            parse = copy.deepcopy(g)
-                            parse.category = c
-                            utterance_semantic_pairs.append([x, parse, g])
-                elif verbose > 0:
-                    print ("get_semantic_forms_for_induced_pairs: no semantic parse found matching " +
-                           "grounding for pair '" + str(x) + "', " + self.parser.print_parse(g))
+        return pairs
 
+    # Get utterance/semantic form/grounding triples for the induced pairs as the condor map-reduce does, but over a
+    # local pool of induction_workers processes that each hold a copy of this Agent. Pairs are streamed to workers
+    # as they free up. A pair that raises, runs past pair_timeout seconds, or whose worker does not report back
+    # within pair_timeout plus a grace period (e.g., because it hung or died) counts as failed. A failed pair is
+    # retried up to pair_retries times and then abandoned. Returns [utterance, 'ccg : form' string, grounding]
+    # triples in pair order.
+    def get_raw_semantic_forms_for_induced_pairs_in_pool(self, parse_reranker_beam, interpolation_reranker_beam,
+                                                         verbose, induction_workers, pair_timeout, pair_retries):
+        grace = 10  # seconds beyond pair_timeout to wait for a worker to report a pair
+        pool = multiprocessing.Pool(processes=induction_workers, initializer=init_induction_worker,
+                                    initargs=(self,))
+        d = self.induced_utterance_grounding_pairs
+        results = {}
+        attempts = {}
+        for idx in range(len(d)):
+            x, g = d[idx]
+            results[idx] = pool.apply_async(get_semantic_forms_for_induced_pair_in_worker,
+                                            ((x, g, parse_reranker_beam, interpolation_reranker_beam,
+                                              verbose, pair_timeout),))
+            attempts[idx] = 1
+
+        # Collect pairs in the order they were handed to workers, so that when a pair is waited on, every pair
+        # handed out before it has finished and it is already running. Retries go to the back of the line.
+        found = {}
+        abandoned = 0
+        hung = False
+        pending = collections.deque(range(len(d)))
+        while len(pending) > 0:
+            idx = pending.popleft()
+            pairs = None
+            try:
+                pairs = results[idx].get(timeout=pair_timeout + grace if pair_timeout is not None else None)
+                if pairs is None:
+                    print ("get_semantic_forms_for_induced_pairs: pair idx " + str(idx) + " timed out after " +
+                           str(pair_timeout) + " seconds")
+            except multiprocessing.TimeoutError:
+                print ("get_semantic_forms_for_induced_pairs: pair idx " + str(idx) + " did not report back after " +
+                       str(pair_timeout + grace) + " seconds")
+                hung = True
+            except Exception as e:
+                print ("get_semantic_forms_for_induced_pairs: pair idx " + str(idx) + " failed with " + repr(e))
+            if pairs is not None:
+                found[idx] = pairs
+            elif attempts[idx] > pair_retries:
+                abandoned += 1
+            else:
+                x, g = d[idx]
+                results[idx] = pool.apply_async(get_semantic_forms_for_induced_pair_in_worker,
+                                                ((x, g, parse_reranker_beam, interpolation_reranker_beam,
+                                                  verbose, pair_timeout),))
+                attempts[idx] += 1
+                pending.append(idx)
+        if hung:
+            pool.terminate()  # a hung worker would never let the pool join
+        else:
+            pool.close()
+            pool.join()
+
+        raw_pairs = []
+        for idx in sorted(found.keys()):
+            raw_pairs.extend(found[idx])
+        print ("get_semantic_forms_for_induced_pairs: finished " + str(len(d) - abandoned) + " of " + str(len(d)) +
+               " pairs; abandoned " + str(abandoned) + " after " + str(pair_retries) + " retries; got " +
+               str(len(raw_pairs)) + " actual pairs")
+        return raw_pairs
+
+    # Since we distributed the computation, we need to update the local Ontology with any new types
+    # that were introduced by weird 'and' rules in the pairs.
+    # We do this by getting sem forms as strings, so we need to read them in afresh now.
+    def read_raw_induced_pairs(self, raw_pairs):
+        utterance_semantic_pairs = []
+        for s, sem_str, g in raw_pairs:
+            ccg_str, form_str = sem_str.split(" : ")
+            ccg = self.parser.lexicon.read_category_from_str(ccg_str)
+            form = self.parser.lexicon.read_semantic_form_from_str(form_str, None, None, [])
+            form.category = ccg
+            utterance_semantic_pairs.append([s, form, g])
         return utterance_semantic_pairs
 
+    # Given a parse, its parser score, the groundings of its semantic form, and a target grounding g, return the
+    # parse with its score interpolated with that of the first (most confident) grounding matching g, or None if
+    # none match.
+    def get_grounding_matched_parse(self, parse, score, gs, g):
+        if gs is not None:
+            gn = self.sort_groundings_by_conf(gs)
+        else:
+            gn = []
+        for gz, g_score in gn:
+            print ("get_semantic_forms_for_induced_pairs: ...... form grounded to " +
+                   str(self.parser.print_parse(gz) if type(gz) is not bool else str(gz)) +
+                   " with score " + str(g_score))
+            if ((type(gz) is bool and gz == g) or
+                    (type(gz) is not bool and g.equal_allowing_commutativity(gz, self.parser.ontology))):
+                print ("get_semantic_forms_for_induced_pairs: ... found semantic form " +
+                       self.parser.print_parse(parse.node, True) +
+                       " with scores p " + str(score) + ", g " + str(g_score))
+                return [parse, score + math.log(g_score + 1.0)]  # add 1 for zero probabilities
+        return None
+
+    # Match parses from a cky parse generator against a target grounding g as get_semantic_forms_for_induced_pairs
+    # does, but as a pipeline: the parses are grounded in the grounding worker pool while later parses are produced,
+    # keeping up to grounding_workers groundings in flight. Results are consumed in parse order and production stops
+    # once interpolation_reranker_beam matches are found, so the matched parses are those the sequential loop finds.
+    def get_grounding_matched_parses_pipelined(self, cky_parse_generator, g, interpolation_reranker_beam, verbose):
+        pool = self.get_grounding_pool()
+        parses = []
+        in_flight = collections.deque()  # of (parse, score, async grounding result)
+        latent_forms_considered = 0
+        produced_all = False
+        while len(parses) < interpolation_reranker_beam:
+
+            # Produce parses and start grounding them until the pipeline is full.
+            while (not produced_all and len(in_flight) < self.grounding_workers and
+                   latent_forms_considered + 1 < self.latent_forms_to_consider_for_induction):
+                cgtr = next(cky_parse_generator)
+                if cgtr is None or cgtr[0] is None:
+                    produced_all = True
+                    break
+                parse, score = cgtr[0], cgtr[1]
+                if verbose > 2:
+                    print ("get_semantic_forms_for_induced_pairs: ... grounding semantic form " +
+                           self.parser.print_parse(parse.node, True) + " with scores p " + str(score))
+                # Allow grounder to run indefinitely at training time.
+                in_flight.append((parse, score,
+                                  pool.apply_async(ground_semantic_form_in_worker,
+                                                   (self.get_grounding_task(parse.node, None, None),))))
+                latent_forms_considered += 1
+            if len(in_flight) == 0:
+                break
+
+            # Consume the oldest grounding.
+            parse, score, result = in_flight.popleft()
+            gs, _ = result.get()
+            match = self.get_grounding_matched_parse(parse, score, gs, g)
+            if match is not None:
+                parses.append(match)
+
+        return parses
+
     def call_function_with_timeout(self, f, args, t):
         if t is not None:
             signal.signal(signal.SIGALRM, self.timeout_signal_handler)
@@ -1683,7 +1976,8 @@ class Agent:
                 r = f(**args)
             except RuntimeError:
                 r = None
-            signal.alarm(0)
+            finally:
+                signal.alarm(0)  # also when f raises, so the alarm cannot go off later
         else:
             r = f(**args)
         return r
@@ -1691,3 +1985,58 @@ class Agent:
     def timeout_signal_handler(self, signum, frame):
         raise RuntimeError()
 
+
+# The grounder held by each grounding worker process, set when the worker starts, and the KB version and ontology
+# size its KB state is at.
+grounding_worker_grounder = None
+grounding_worker_version = None
+
+
+# Pool initializer for grounding workers.
+def init_grounding_worker(grounder, version):
+    global grounding_worker_grounder, grounding_worker_version
+    grounding_worker_grounder = grounder
+    grounding_worker_version = version
+
+
+# Pool task for grounding workers; takes a (semantic form, deadline, k, version, state filename) tuple and returns
+# the groundings ground_semantic_tree finds for it and whether it timed out. If the worker's grounder is older than
+# version, its KB state and ontology are first reloaded from the file Agent.write_grounding_state wrote.
+def ground_semantic_form_in_worker(task):
+    global grounding_worker_version
+    s, deadline, k, version, state_fn = task
+    if version != grounding_worker_version:
+        with open(state_fn, 'rb') as f:
+            kb, ontology = pickle.load(f)
+        kb.pc.features = grounding_worker_grounder.kb.pc.features
+        grounding_worker_grounder.kb = kb
+        grounding_worker_grounder.parser.ontology = ontology
+        grounding_worker_version = version
+    gs = grounding_worker_grounder.ground_semantic_tree(s, deadline=deadline, k=k)
+    return gs, grounding_worker_grounder.last_grounding_memo_stats['timed_out']
+
+
+# The Agent held by each induction worker process, set once when the worker starts.
+induction_worker_agent = None
+
+
+# Pool initializer for induction workers. Workers ground sequentially, since pool workers cannot start pools.
+def init_induction_worker(agent):
+    global induction_worker_agent
+    induction_worker_agent = agent
+    induction_worker_agent.grounding_workers = 1
+
+
+# Pool task for induction workers; takes an (utterance, grounding, parse reranker beam, interpolation reranker beam,
+# verbose, timeout) tuple and returns the pair's [utterance, 'ccg : form' string, grounding] triples, or None if
+# finding them took longer than timeout seconds.
+def get_semantic_forms_for_induced_pair_in_worker(task):
+    x, g, parse_reranker_beam, interpolation_reranker_beam, verbose, timeout = task
+    a = induction_worker_agent
+    pairs = a.call_function_with_timeout(a.get_semantic_forms_for_induced_pair,
+                                         {"x": x, "g": g, "parse_reranker_beam": parse_reranker_beam,
+                                          "interpolation_reranker_beam": interpolation_reranker_beam,
+                                          "verbose": verbose}, timeout)
+    if pairs is None:
+        return None
+    return [[x, a.parser.print_parse(form, True), g] for _, form, _ in pairs]
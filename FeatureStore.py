@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+__author__ = 'jesse'
+
+import argparse
+import hashlib
+import numpy as np
+import os
+import pickle
+
+
+# Object observation features laid out contiguously per (behavior, modality) context.
+# Each context holds one float32 2-D array whose rows are observation vectors, and an offsets index from each
+# oidx to the [start, end) rows holding that object's observations. Stores converted to disk live in a
+# 'feature_store' directory next to features.pickle as one .npy per context plus an index pickle, and are
+# memory-mapped read-only on load so several agent processes on one host share the same pages.
+class FeatureStore:
+
+    def __init__(self, store_dir=None):
+        self.store_dir = None  # str; the directory the store was loaded from, or None if built in memory
+        self.contexts = None  # list of (behavior, modality) str tuples with observations for at least one object
+        self.arrays = None  # behavior, modality indexed dictionaries into float32 2-D observation arrays
+        self.offsets = None  # behavior, modality indexed dictionaries from oidx to (start, end) row tuples
+
+        if store_dir is not None:
+            self.store_dir = os.path.abspath(store_dir)
+            self.load(self.store_dir)
+
+    # Read the index and memory-map the per-context arrays of a store written by save.
+    def load(self, store_dir):
+        with open(os.path.join(store_dir, "index.pickle"), 'rb') as f:
+            self.contexts, self.offsets = pickle.load(f)
+        self.arrays = {}
+        for b, m in self.contexts:
+            if b not in self.arrays:
+                self.arrays[b] = {}
+            self.arrays[b][m] = np.load(os.path.join(store_dir, get_context_fn(b, m)), mmap_mode='r')
+
+    # Write the store to store_dir as one .npy per context plus the index.
+    def save(self, store_dir):
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+        for b, m in self.contexts:
+            np.save(os.path.join(store_dir, get_context_fn(b, m)), np.asarray(self.arrays[b][m]))
+        with open(os.path.join(store_dir, "index.pickle"), 'wb') as f:
+            pickle.dump([self.contexts, self.offsets], f)
+
+    # Whether the given object has observations in the given context.
+    def has_context(self, oidx, behavior, modality):
+        return (behavior in self.offsets and modality in self.offsets[behavior] and
+                oidx in self.offsets[behavior][modality])
+
+    # Given a context and label pairs, returns the stacked observation rows of the labeled objects and a parallel
+    # list of -1/1 labels. Objects without observations in the context are skipped.
+    def get_data(self, behavior, modality, pairs):
+        rows = []
+        y = []
+        for oidx, label in pairs:
+            if self.has_context(oidx, behavior, modality):
+                start, end = self.offsets[behavior][modality][oidx]
+                rows.append((start, end))
+                y.extend([1 if label == 1 else -1] * (end - start))
+        return self.get_rows(behavior, modality, rows), y
+
+    # Given a context and a list of object idxs, returns the stacked observation rows of those objects alongside,
+    # for each row, the position in oidxs of the object it came from.
+    def get_observations(self, behavior, modality, oidxs):
+        rows = []
+        owners = []
+        for jdx in range(len(oidxs)):
+            if self.has_context(oidxs[jdx], behavior, modality):
+                start, end = self.offsets[behavior][modality][oidxs[jdx]]
+                rows.append((start, end))
+                owners.extend([jdx] * (end - start))
+        return self.get_rows(behavior, modality, rows), owners
+
+    # Slice the given (start, end) row ranges out of a context array, avoiding a copy when they are one run.
+    def get_rows(self, behavior, modality, rows):
+        if len(rows) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        a = self.arrays[behavior][modality]
+        if len(rows) == 1:
+            return a[rows[0][0]:rows[0][1]]
+        return np.concatenate([a[start:end] for start, end in rows])
+
+    # Returns a hash of a context's observations and which objects they belong to, for keying anything fit on them.
+    def get_fingerprint(self, behavior, modality):
+        h = hashlib.sha1(np.ascontiguousarray(self.arrays[behavior][modality]))
+        h.update(repr(sorted(self.offsets[behavior][modality].items())).encode('utf-8'))
+        return h.hexdigest()
+
+    # Pickle only the location of stores that live on disk so that unpickled copies (e.g., a pickled grounder)
+    # memory-map the same files instead of carrying their own copy of every feature.
+    def __getstate__(self):
+        if self.store_dir is not None:
+            return {'store_dir': self.store_dir}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'arrays' not in state:
+            self.load(self.store_dir)
+
+
+# The array filename for a context.
+def get_context_fn(behavior, modality):
+    return behavior + "__" + modality + ".npy"
+
+
+# Given the nested features dictionary of oidx -> behavior -> modality -> list of observation vectors, build an
+# in-memory FeatureStore with the same observations.
+def build_feature_store(features):
+    fs = FeatureStore()
+    fs.contexts = []
+    fs.arrays = {}
+    fs.offsets = {}
+    rows = {}
+    for oidx in features:
+        for b in features[oidx]:
+            for m in features[oidx][b]:
+                if (b, m) not in rows:
+                    fs.contexts.append((b, m))
+                    rows[(b, m)] = []
+                    if b not in fs.offsets:
+                        fs.offsets[b] = {}
+                    fs.offsets[b][m] = {}
+                start = len(rows[(b, m)])
+                for obs in features[oidx][b][m]:
+                    if len(obs) == 1 and type(obs[0]) is list:  # un-nest single observation vectors
+                        obs = obs[0]
+                    rows[(b, m)].append(obs)
+                fs.offsets[b][m][oidx] = (start, len(rows[(b, m)]))
+    for b, m in fs.contexts:
+        if b not in fs.arrays:
+            fs.arrays[b] = {}
+        fs.arrays[b][m] = np.array(rows[(b, m)], dtype=np.float32)
+        if fs.arrays[b][m].ndim != 2:
+            raise ValueError("observations for context " + str((b, m)) + " are not all the same length")
+    return fs
+
+
+# Load the FeatureStore for a feature directory, memory-mapping the converted store if there is one and
+# otherwise building one in memory from features.pickle.
+def load_feature_store(feature_dir):
+    store_dir = os.path.join(feature_dir, "feature_store")
+    if os.path.isfile(os.path.join(store_dir, "index.pickle")):
+        return FeatureStore(store_dir)
+    with open(os.path.join(feature_dir, "features.pickle"), 'rb') as f:
+        return build_feature_store(pickle.load(f))
+
+
+# One-time conversion of a feature directory's features.pickle into a memory-mappable store.
+def main():
+    feature_dir = FLAGS_feature_dir
+
+    print("main: reading features.pickle from " + feature_dir + "...")
+    with open(os.path.join(feature_dir, "features.pickle"), 'rb') as f:
+        fs = build_feature_store(pickle.load(f))
+    print("main: ... done")
+
+    store_dir = os.path.join(feature_dir, "feature_store")
+    print("main: writing feature store to " + store_dir + "...")
+    fs.save(store_dir)
+    for b, m in fs.contexts:
+        print("main: ... " + b + ", " + m + ": " + str(fs.arrays[b][m].shape))
+    print("main: ... done")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--feature_dir', type=str, required=True,
+                        help="perception feature directory containing the features.pickle to convert")
+    args = parser.parse_args()
+    for k, v in vars(args).items():
+        globals()['FLAGS_%s' % k] = v
+    main()
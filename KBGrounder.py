@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 __author__ = 'jesse'
 
+import collections
 import copy
+import json
 import KnowledgeBase
+import numpy as np
 import signal
 import time
 
@@ -13,39 +16,229 @@ class KBGrounder:
     # perception_source_dir - the directory for perception source containing predicates, labels, and trained classifiers
     # perception_feature_dir - the directory for perception containing oidxs and object features
     # active_test_set - a list of oidxs to consider as test objects (labels ignored during SVM training/testing)
+    # training_workers - the number of processes to spread perception classifier training across
+    # kappa_mode - 'exact' or 'support' leave-one-object-out kappa estimation during classifier training
+    # online_updates - whether to fold new perception labels into classifiers online and defer full refits
+    # classifier_backend - the PerceptionClassifiers.classifier_backends entry perception classifiers are fit with
+    # assignment_conf_threshold - perceptual confidence at or below which a lambda assignment under 'a' or 'the' is
+    #                             pruned before grounding; 0 prunes only assignments that cannot ground to True
+    # engine - 'recursive' to ground the body of a lambda once per assignment, or 'vectorized' to ground 'a' and
+    #          'the' over conjunctions of KB predicates as array operations across all assignments at once, falling
+    #          back to recursive grounding for other forms
+    # the_grounding - 'unique' to ground 'the' to the one lambda assignment that makes its argument True, if only one
+    #                 does, or 'singleton' to ground it only if its argument has exactly one grounding and that is
+    #                 True, counting False groundings of every assignment, as the grounder did before assignments
+    #                 were pruned; 'singleton' does not prune the assignments of the argument of 'the'
+    # grounding_cache_size - how many semantic forms' groundings to keep across calls, least recently used evicted
+    # profile_fn - a file to append a JSON line profiling each ground_semantic_tree call to, or None to not profile
     def __init__(self, parser, static_facts_fn,
                  perception_source_dir, perception_feature_dir,
                  active_test_set,
-                 behaviors=None, modalities=None):
+                 behaviors=None, modalities=None, training_workers=1, kappa_mode='exact',
+                 online_updates=False, classifier_backend='svc', assignment_conf_threshold=0.0,
+                 engine='recursive', the_grounding='unique', grounding_cache_size=1000, profile_fn=None):
+        if engine not in ['recursive', 'vectorized']:
+            raise ValueError("unknown grounding engine '" + str(engine) + "'")
+        if the_grounding not in ['unique', 'singleton']:
+            raise ValueError("unknown 'the' grounding '" + str(the_grounding) + "'")
         self.parser = parser
         self.kb = KnowledgeBase.KnowledgeBase(static_facts_fn, perception_source_dir, perception_feature_dir,
                                               active_test_set, parser.ontology if parser is not None else None,
-                                              behaviors=behaviors, modalities=modalities)
+                                              behaviors=behaviors, modalities=modalities,
+                                              training_workers=training_workers, kappa_mode=kappa_mode,
+                                              online_updates=online_updates, classifier_backend=classifier_backend)
         self.active_test_set = active_test_set
+        self.assignment_conf_threshold = assignment_conf_threshold
+        self.engine = engine
+        self.the_grounding = the_grounding
+        self.grounding_cache_size = grounding_cache_size
+        self.grounding_cache = collections.OrderedDict()  # (form key, versions) -> groundings, least recent first
+        self.grounding_cache_hits = 0
+        self.grounding_cache_misses = 0
+        self.profile_fn = profile_fn
+        self.grounding_profile = None  # the profile record of the call in progress, if profiling
+        # dict of subtree memo 'hits', 'misses', and 'entries', of lambda assignments 'pruned', of subtrees
+        # grounded by the 'vectorized' engine, of whether the deadline 'timed_out', and of whether the groundings
+        # were 'cached' for the last call
+        self.last_grounding_memo_stats = None
 
     # Given a semantic tree, return a list of trees with the lambdas of the original tree filled by every possible
     # grounding that satisfies those lambdas.
-    def ground_semantic_tree(self, root):
+    # Lambda assignments often instantiate identical subtrees (e.g., the same inner a_l(...) under every
+    # assignment of an outer lambda), so groundings are memoized per call by subtree and each distinct subtree
+    # is grounded once; the memo's statistics for the call are left in last_grounding_memo_stats.
+    # deadline - a time.time() value after which grounding stops expanding lambda assignments and combinations of
+    #            child groundings and returns the groundings found so far, possibly none; 'the' over an argument
+    #            whose grounding was cut short has no groundings, since its referent may not be unique
+    # k - if the deadline passes, the groundings found so far are sorted by confidence and only the first k are
+    #     returned; this truncates what was found rather than steering the search towards confident groundings
+    # Complete groundings are also cached across calls by the form's structure, the versions of the ontology and KB
+    # they were grounded against, and the grounder settings that change them, so forms that recur across turns and
+    # dialogs (e.g., 'yes', 'no', and names) are grounded once until the KB or perception classifiers change.
+    # If profile_fn is set, a JSON record profiling the call is appended to it (see start_grounding_profile).
+    def ground_semantic_tree(self, root, deadline=None, k=None):
+        debug = False
+
+        if self.profile_fn is not None:
+            self.start_grounding_profile(root)
+
+        cache_key = (self.get_subtree_key(root), len(self.parser.ontology.preds), self.kb.get_version(),
+                     tuple(self.active_test_set) if self.active_test_set is not None else None,
+                     self.assignment_conf_threshold, self.the_grounding)
+        if cache_key in self.grounding_cache:
+            self.grounding_cache_hits += 1
+            self.grounding_cache.move_to_end(cache_key)
+            self.last_grounding_memo_stats = {'hits': 0, 'misses': 0, 'pruned': 0, 'vectorized': 0,
+                                              'timed_out': False, 'cached': True, 'entries': 0}
+            groundings = self.grounding_cache[cache_key]
+            if self.grounding_profile is not None:
+                self.write_grounding_profile(groundings)
+            return copy.deepcopy(groundings)  # a copy each hit, so callers cannot mutate the cached entry
+        self.grounding_cache_misses += 1
+
+        memo = {}
+        stats = {'hits': 0, 'misses': 0, 'pruned': 0, 'vectorized': 0, 'timed_out': False, 'cached': False}
+        groundings = self.ground_semantic_subtree(root, memo, stats, deadline=deadline)
+        stats['entries'] = len(memo)
+        self.last_grounding_memo_stats = stats
+        if stats['timed_out']:
+            if k is not None and groundings is not None:
+                groundings = sorted(groundings, key=lambda g: g[2], reverse=True)[:k]
+        elif self.grounding_cache_size > 0:
+            # Groundings can share nodes with root, which callers may go on to modify, so the cache keeps a copy.
+            self.grounding_cache[cache_key] = copy.deepcopy(groundings)
+            while len(self.grounding_cache) > self.grounding_cache_size:
+                self.grounding_cache.popitem(last=False)
+        if debug:
+            print("ground_semantic_tree: subtree memo stats " + str(stats))
+        if self.grounding_profile is not None:
+            self.write_grounding_profile(groundings)
+        return groundings
+
+    # Begin a profile record for grounding root, which grounding methods fill in while it is in progress.
+    # The record holds the form, the engine, the time spent in each kind of node exclusive of the nodes below it
+    # ('branch_ms') and how many of each were grounded ('branch_nodes'), and counts of lambda 'assignments'
+    # enumerated, tree node 'copies' made, KB 'queries' issued through query_idxs and 'array_queries' issued by the
+    # vectorized engine; write_grounding_profile completes it.
+    def start_grounding_profile(self, root):
+        self.grounding_profile = {'form': self.parser.print_parse(root, True), 'engine': self.engine,
+                                  'time': time.time(), 'branch_ms': {}, 'branch_nodes': {}, 'nested_ms': 0.0,
+                                  'assignments': 0, 'copies': 0, 'array_queries': 0,
+                                  'kb_queries_before': self.kb.query_cache_hits + self.kb.query_cache_misses}
+
+    # Complete the profile record in progress with the groundings returned and the call's memo statistics, and append
+    # it to profile_fn as a line of JSON.
+    def write_grounding_profile(self, groundings):
+        profile = self.grounding_profile
+        self.grounding_profile = None
+        profile['ms'] = 1000 * (time.time() - profile['time'])
+        profile['queries'] = self.kb.query_cache_hits + self.kb.query_cache_misses - profile['kb_queries_before']
+        profile['groundings'] = len(groundings) if groundings is not None else None
+        profile.update(self.last_grounding_memo_stats)
+        del profile['nested_ms']
+        del profile['kb_queries_before']
+        with open(self.profile_fn, 'a') as f:
+            f.write(json.dumps(profile, sort_keys=True) + "\n")
+
+    # Start timing a node being grounded for the profile in progress, returning what end_profile_node needs.
+    def start_profile_node(self):
+        nested_ms = self.grounding_profile['nested_ms']
+        self.grounding_profile['nested_ms'] = 0.0
+        return time.time(), nested_ms
+
+    # Attribute the time since start_profile_node, less that of the nodes grounded below it, to the given branch.
+    def end_profile_node(self, branch, started):
+        profile = self.grounding_profile
+        ms = 1000 * (time.time() - started[0])
+        profile['branch_ms'][branch] = profile['branch_ms'].get(branch, 0.0) + ms - profile['nested_ms']
+        profile['branch_nodes'][branch] = profile['branch_nodes'].get(branch, 0) + 1
+        profile['nested_ms'] = started[1] + ms
+
+    # Returns the grounding cache's hit and miss counts since the last reset and its current number of entries.
+    def get_grounding_cache_stats(self):
+        return {'hits': self.grounding_cache_hits, 'misses': self.grounding_cache_misses,
+                'size': len(self.grounding_cache)}
+
+    # Empties the grounding cache and zeroes its counters.
+    def reset_grounding_cache(self):
+        self.grounding_cache = collections.OrderedDict()
+        self.grounding_cache_hits = 0
+        self.grounding_cache_misses = 0
+
+    # Returns a hashable key identifying a semantic subtree by its structure, so that separately instantiated but
+    # identical subtrees share a key.
+    def get_subtree_key(self, root):
+        return (root.idx, root.type, root.category, root.is_lambda, root.is_lambda_instantiation, root.lambda_name,
+                tuple([self.get_subtree_key(c) for c in root.children]) if root.children is not None else None)
+
+    # Ground a subtree as ground_semantic_tree does, reusing the groundings in memo of identical subtrees and
+    # tallying memo hits and misses in stats.
+    # true_only - whether the caller keeps only True groundings of root (e.g., root is the argument of 'a'), in which
+    #             case lambda assignments that cannot make root True are pruned rather than grounded
+    # deadline - as for ground_semantic_tree; passing it is recorded as 'timed_out' in stats
+    # Groundings of a subtree cut short by the deadline are incomplete, so they are not memoized.
+    def ground_semantic_subtree(self, root, memo, stats, true_only=False, deadline=None):
+        true_only = true_only and root.is_lambda_instantiation  # only lambda instantiations prune
+        key = (self.get_subtree_key(root), true_only)
+        if key in memo:
+            stats['hits'] += 1
+            return memo[key][:]
+        stats['misses'] += 1
+
+        # While root is grounded, stats['timed_out'] records whether root's own grounding timed out.
+        timed_out = stats['timed_out']
+        stats['timed_out'] = False
+        groundings = self.ground_semantic_node(root, memo, stats, true_only, deadline)
+        if groundings is not None and not stats['timed_out']:
+            memo[key] = groundings
+        stats['timed_out'] = stats['timed_out'] or timed_out
+        return groundings[:] if groundings is not None else None
+
+    # Ground root for ground_semantic_subtree, grounding its subtrees through ground_semantic_subtree.
+    # Past the deadline, every loop that expands lambda assignments or combinations of child groundings stops and
+    # the groundings found so far, possibly none, are returned.
+    def ground_semantic_node(self, root, memo, stats, true_only, deadline):
         debug = False
         if debug:
             print("ground_semantic_tree: grounding at root " + self.parser.print_parse(root))
 
-        start_time = time.time()
+        profiled = self.start_profile_node() if self.grounding_profile is not None else None
+
+        # The vectorized engine grounds 'a' and 'the' over supported lambda bodies without instantiating them.
+        if (self.engine == 'vectorized' and not root.is_lambda_instantiation and root.children is not None and
+                len(root.children) == 1 and (self.is_logical(root.idx, 'the') or self.is_logical(root.idx, 'a'))):
+            groundings = self.ground_quantifier_vectorized(root, stats)
+            if groundings is not None:
+                stats['vectorized'] += 1
+                if profiled is not None:
+                    self.end_profile_node('vectorized', profiled)
+                return groundings
 
         # If the head of the tree is a lambda instantiation, add candidates for all its possible fills.
         # Every grounding entry is a tuple of a tree (or bool), the lambda values instantiated at and below root,
         # and a confidence.
         groundings = []
         if root.is_lambda_instantiation:
-            for assignment in self.assignments_for_type(root.type):  # assignments are ont pred idxs
+            branch = 'lambda'
+            assignments = self.assignments_for_type(root.type)  # assignments are ont pred idxs
+            if true_only:
+                plausible = self.prune_assignments(root, assignments)
+                stats['pruned'] += len(assignments) - len(plausible)
+                assignments = plausible
+            for assignment in assignments:
+                if self.past_deadline(deadline, stats):
+                    break
+                if profiled is not None:
+                    self.grounding_profile['assignments'] += 1
 
-                # Form candidate sub-tree with this assignment instantiated.
-                candidate = copy.deepcopy(root.children[0])
-                self.instantiate_lambda(candidate, root.lambda_name, assignment)
+                # Form candidate sub-tree with this assignment instantiated, sharing the subtrees it leaves alone.
+                candidate = self.instantiate_lambda(root.children[0], root.lambda_name, assignment)
 
                 # Call this grounding routine on the candidate to get finished products.
-                candidate_groundings = self.ground_semantic_tree(candidate)
+                candidate_groundings = self.ground_semantic_subtree(candidate, memo, stats, deadline=deadline)
                 if candidate_groundings is None:
+                    if profiled is not None:
+                        self.end_profile_node(branch, profiled)
                     return None
                 groundings.extend([(cg, [assignment] + la, conf) for cg, la, conf in candidate_groundings])
 
@@ -57,21 +250,29 @@ class KBGrounder:
 
             # Get forms of this tree with children grounded, then apply the predicate to those grounded
             # children to return appropriately.
+            # 'a' and 'the' keep only the True groundings of their lambda-headed argument, unless 'the' needs the
+            # False ones to ground as a 'singleton'.
+            child_true_only = (self.is_logical(root.idx, 'a') or
+                               (self.is_logical(root.idx, 'the') and self.the_grounding == 'unique'))
             child_groundings = []
             for c in root.children:
-                result = self.ground_semantic_tree(c)
+                result = self.ground_semantic_subtree(c, memo, stats, true_only=child_true_only, deadline=deadline)
                 if result is None:
+                    if profiled is not None:
+                        self.end_profile_node('children', profiled)
                     return None
                 child_groundings.append(result)
-            child_groundings = [self.ground_semantic_tree(c) for c in root.children]
             if debug:
                 print("ground_semantic_tree: for root " + self.parser.print_parse(root) + ", child_groundings: " +
                       str(child_groundings))
 
             # Logical predicates.
             if self.is_logical(root.idx, 'equals'):
+                branch = 'equals'
                 # Return instances of ground child trees that match.
                 for cidx in range(len(child_groundings[0])):
+                    if self.past_deadline(deadline, stats):
+                        break
                     ci_tree = child_groundings[0][cidx][0]
                     ci_la = child_groundings[0][cidx][1]
                     conf = child_groundings[0][cidx][2]
@@ -81,11 +282,12 @@ class KBGrounder:
                         conf *= child_groundings[1][cjdx][2]
                         if ci_tree.equal_allowing_commutativity(cj_tree, self.parser.ontology,
                                                                 ignore_syntax=True):
-                            match = copy.deepcopy(root)
+                            match = self.copy_node(root)
                             match.children = [ci_tree, cj_tree]
                             groundings.append((match, ci_la + cj_la, conf))
 
             elif self.is_logical(root.idx, 'and'):
+                branch = 'and'
                 if debug:
                     print ("ground_semantic_tree: processing 'and' root")
                 if len(child_groundings) < 2:
@@ -100,6 +302,8 @@ class KBGrounder:
                 for cj in range(1, len(child_groundings)):
                     lc_j = []
                     for comb in cc_lc[cj - 1]:
+                        if self.past_deadline(deadline, stats):
+                            break
                         ci_bool = child_groundings[0][comb[0]][0]
                         for cjdx in range(len(child_groundings[cj])):  # and takes arbitrarily many children
                             cj_bool = child_groundings[cj][cjdx][0]
@@ -117,31 +321,42 @@ class KBGrounder:
                         groundings.append((match, la_ext, conf))
 
             elif self.is_logical(root.idx, 'or'):
+                branch = 'or'
                 # TODO: implement 'or' similar to 'and' but returning all matches with at least one true child
                 print("WARNING: KBGrounder: logical 'or' not yet implemented")
                 pass
 
             elif self.is_logical(root.idx, 'the'):
+                branch = 'the'
                 if debug:
                     print ("ground_semantic_tree: processing 'the' root")
-                # Return the lambda assignment of the child lambda instantiation below this node if it is a singleton,
-                # else return no groundings.
-                if len(child_groundings[0]) == 1:
-                    c, la, conf = child_groundings[0]  # 'the' takes one argument which must be lambda-headed
-                    if c:  # if the assignment created a True statement, the 'the' condition is satisfied
-                        singleton = copy.deepcopy(root)
-                        singleton.idx = la[0]  # change 'the' into the instantiation
-                        singleton.type = self.parser.ontology.entries[la[0]]
-                        singleton.children = None
-                        groundings.append((singleton, [], conf))  # ignore lambda assignments contained below this level
+                # Return the lambda assignment of the child lambda instantiation below this node if it is the only
+                # one that makes the child True, else return no groundings. False groundings of other assignments
+                # do not count against uniqueness, so the result does not depend on which were pruned.
+                # As a 'singleton', return it only if it is the child's one grounding, False groundings included.
+                # If the argument's grounding timed out, assignments that make it True may be missing, so uniqueness
+                # is unknown and there are no groundings either.
+                true_groundings = [(la, conf) for c, la, conf in child_groundings[0] if c]  # lambda-headed argument
+                if self.the_grounding == 'unique':
+                    unique = len(set([la[0] for la, _ in true_groundings])) == 1
+                else:
+                    unique = len(child_groundings[0]) == 1 and len(true_groundings) == 1
+                if not stats['timed_out'] and unique:
+                    la, conf = max(true_groundings, key=lambda t: t[1])
+                    singleton = self.copy_node(root)
+                    singleton.idx = la[0]  # change 'the' into the instantiation
+                    singleton.type = self.parser.ontology.entries[la[0]]
+                    singleton.children = None
+                    groundings.append((singleton, [], conf))  # ignore lambda assignments contained below this level
 
             elif self.is_logical(root.idx, 'a'):
+                branch = 'a'
                 if debug:
                     print ("ground_semantic_tree: processing 'a' root")
                 # Return the lambda assignments of the child lambda instantiation below this node
                 for c, la, conf in child_groundings[0]:  # 'a' takes one argument which must be lambda-headed
                     if c:  # if the assignment created a True statement, the 'a' condition is satisfied
-                        inst = copy.deepcopy(root)
+                        inst = self.copy_node(root)
                         inst.idx = la[0]  # change 'a' into the instantiation
                         inst.type = self.parser.ontology.entries[la[0]]
                         inst.children = None
@@ -149,20 +364,22 @@ class KBGrounder:
 
             # KB predicates (any predicate whose eventual return type is 't')
             elif root.return_type == self.parser.ontology.types.index('t'):
+                branch = 'query'
                 if debug:
                     print ("ground_semantic_tree: processing query root")
 
-                # Assemble queries from the predicate and its children.
-                queries = [[self.parser.ontology.preds[root.idx]]]  # every child combination will extend this query set
+                # Assemble queries of ontology idxs from the predicate and its children.
+                queries = [[root.idx]]  # every child combination will extend this query set
                 for cidx in range(len(child_groundings)):
                     queries_ext = []
                     for gidx in range(len(child_groundings[cidx])):
-                        args = [self.parser.ontology.preds[child_groundings[cidx][gidx][0].idx]]
+                        args = [child_groundings[cidx][gidx][0].idx]
 
                         # Verify that all object oidx args are part of the active_test_set.
                         active_test_query = True
                         for arg in args:
-                            if 'oidx' in arg and int(arg.split('_')[1]) not in self.active_test_set:
+                            oidx = self.kb.get_atom_oidx(arg)
+                            if oidx is not None and oidx not in self.active_test_set:
                                 active_test_query = False
                                 break
 
@@ -174,9 +391,12 @@ class KBGrounder:
                 # Run queries to get groundings.
                 # Ignore lambda assignments contained below this level.
                 for q in queries:
+                    if self.past_deadline(deadline, stats):
+                        break
                     if debug:
-                        print("ground_semantic_tree: running kb query q=" + str(q))
-                    pos_conf, neg_conf = self.kb.query(tuple(q))
+                        print("ground_semantic_tree: running kb query q=" +
+                              str([self.parser.ontology.preds[idx] for idx in q]))
+                    pos_conf, neg_conf = self.kb.query_idxs(tuple(q))
                     if pos_conf > 0:
                         groundings.append((True, [], pos_conf))
                     if neg_conf > 0:
@@ -184,18 +404,21 @@ class KBGrounder:
 
             # Else, root and grounded children can be passed up as they are (e.g. actions).
             else:
+                branch = 'pass'
                 if debug:
                         print ("ground_semantic_tree: no need to ground current root further; " +
                                "forming groundings to return from " + self.parser.print_parse(root))
 
-                build_returns = [copy.deepcopy(root)]
+                build_returns = [self.copy_node(root)]
                 build_conf = [1.0]
                 for cidx in range(len(child_groundings)):
                     inst_children = []
                     inst_conf = []
                     for gidx in range(len(child_groundings[cidx])):
+                        if self.past_deadline(deadline, stats):
+                            break
                         for br_idx in range(len(build_returns)):
-                            inst_c = copy.deepcopy(build_returns[br_idx])
+                            inst_c = self.copy_node(build_returns[br_idx])
                             inst_c.children[cidx] = child_groundings[cidx][gidx][0]
                             inst_children.append(inst_c)
                             inst_conf.append(build_conf[br_idx] * child_groundings[cidx][gidx][2])
@@ -206,6 +429,7 @@ class KBGrounder:
 
         # If the head of the tree is a leaf, just return the singleton of this root.
         else:
+            branch = 'leaf'
             groundings.append((root, [], 1.0))
 
         if debug:
@@ -213,34 +437,223 @@ class KBGrounder:
                    "\n\t" + "\n\t".join([" ".join([str(t) if type(t) is bool else self.parser.print_parse(t),
                                                    str(l), str(c)])
                                         for t, l, c in groundings]))
+        if profiled is not None:
+            self.end_profile_node(branch, profiled)
+        return groundings
+
+    # Returns whether deadline has passed, recording that grounding timed out in stats if so.
+    def past_deadline(self, deadline, stats):
+        if deadline is not None and time.time() > deadline:
+            stats['timed_out'] = True
+            return True
+        return False
+
+    # Returns a shallow copy of root that shares root's children but owns its children list, so the copy's fields
+    # and child slots can be reassigned without touching root or any other tree sharing its subtrees.
+    # Grounding builds result trees from these instead of deep copies; trees it returns share structure with one
+    # another and with the tree being grounded, so callers that modify a grounding should copy it first.
+    def copy_node(self, root):
+        if self.grounding_profile is not None:
+            self.grounding_profile['copies'] += 1
+        n = copy.copy(root)
+        if root.children is not None:
+            n.children = root.children[:]
+        return n
+
+    # Ground an 'a' or 'the' root as ground_semantic_subtree does, but by evaluating the body of its lambda for every
+    # assignment at once as array operations over KB query arrays rather than instantiating it per assignment.
+    # Returns None if the argument is not a lambda whose body is a KB predicate over the lambda and constants or a
+    # (nested) 'and' of those, so that the caller falls back to recursive grounding.
+    def ground_quantifier_vectorized(self, root, stats):
+        arg = root.children[0]
+        if not arg.is_lambda_instantiation:
+            return None
+        domain = self.assignments_for_type(arg.type)
+        if self.grounding_profile is not None:
+            self.grounding_profile['assignments'] += len(domain)
+        body = arg.children[0]
+        evaluated = self.evaluate_body_vectorized(body, arg.lambda_name, domain)
+        if evaluated is None:
+            return None
+        if len(domain) == 0:
+            return []
+        t_conf, t_exists, f_exists = evaluated
+        singleton = self.is_logical(root.idx, 'the') and self.the_grounding == 'singleton'
+
+        # Prune assignments exactly as prune_assignments does for the lambda argument of 'a' and 'the'.
+        plausible = np.ones(len(domain), dtype=bool)
+        conjuncts = body.children if body.children is not None and self.is_logical(body.idx, 'and') else [body]
+        for conjunct in conjuncts if not singleton else []:
+            if self.is_logical(conjunct.idx, 'and') or True not in [c.is_lambda for c in conjunct.children]:
+                continue
+            pos, _ = self.evaluate_atom_vectorized(conjunct, arg.lambda_name, domain)
+            plausible &= pos > (0 if conjunct.idx in self.kb.static_pred_idxs else self.assignment_conf_threshold)
+        stats['pruned'] += len(domain) - int(np.sum(plausible))
+
+        # Every assignment has at most one True and one False grounding of a conjunction; 'the' needs exactly one
+        # plausible assignment to have a True one, and as a 'singleton' no assignment to have a False one, while 'a'
+        # takes every True grounding.
+        groundings = []
+        true_idxs = np.flatnonzero(plausible & t_exists)
+        if self.is_logical(root.idx, 'the') and (len(true_idxs) != 1 or (singleton and np.any(f_exists))):
+            true_idxs = []
+        for didx in true_idxs:
+            inst = self.copy_node(root)
+            inst.idx = domain[didx]
+            inst.type = self.parser.ontology.entries[domain[didx]]
+            inst.children = None
+            groundings.append((inst, [], float(t_conf[didx])))
         return groundings
 
-    # Given a tree, a lambda name, and an assignment, instantiate all lambdas of that name to the assignment.
+    # Evaluate a lambda body over every assignment in domain to the lambda of the given name.
+    # Returns a tuple of numpy arrays over domain: the confidence of the body's True grounding, whether it has one,
+    # and whether it has a False grounding; or None if the body is not a KB predicate over the lambda and constants
+    # or a (nested) 'and' of those.
+    def evaluate_body_vectorized(self, node, name, domain):
+        if node.children is not None and self.is_logical(node.idx, 'and'):
+            evaluated = [self.evaluate_body_vectorized(c, name, domain) for c in node.children]
+            if True in [e is None for e in evaluated]:
+                return None
+            t_conf = evaluated[0][0]
+            for e in evaluated[1:]:
+                t_conf = t_conf * e[0]  # 'and' confidences are the product of its children's
+            return (t_conf, np.logical_and.reduce([e[1] for e in evaluated]),
+                    np.logical_and.reduce([e[2] for e in evaluated]))
+
+        evaluated = self.evaluate_atom_vectorized(node, name, domain)
+        if evaluated is None:
+            return None
+        pos, neg = evaluated
+        return pos, pos > 0, neg > 0
+
+    # Evaluate a KB predicate over the lambda of the given name and constants for every assignment in domain.
+    # Returns numpy arrays of the pos_conf and neg_conf the query for each assignment returns, zeros for both if
+    # grounding would issue no query, or None if node is not such a predicate.
+    def evaluate_atom_vectorized(self, node, name, domain):
+        if (node.children is None or node.is_lambda_instantiation or
+                True in [self.is_logical(node.idx, l) for l in ['equals', 'and', 'or', 'the', 'a']]):
+            return None
+        node.set_return_type(self.parser.ontology)
+        if node.return_type != self.parser.ontology.types.index('t'):
+            return None
+        if True in [c.children is not None or (c.is_lambda and c.lambda_name != name) for c in node.children]:
+            return None
+        var_positions = [idx for idx in range(len(node.children)) if node.children[idx].is_lambda]
+
+        # Grounding issues no queries with objects outside the active test set.
+        for c in node.children:
+            if not c.is_lambda:
+                oidx = self.kb.get_atom_oidx(c.idx)
+                if oidx is not None and oidx not in self.active_test_set:
+                    return np.zeros(len(domain)), np.zeros(len(domain))
+
+        pred = node.idx
+        if self.grounding_profile is not None and len(var_positions) > 0:
+            self.grounding_profile['array_queries'] += 1
+        if len(var_positions) == 0:
+            pos_conf, neg_conf = self.kb.query_idxs(tuple([pred] + [c.idx for c in node.children]))
+            return np.full(len(domain), pos_conf), np.full(len(domain), neg_conf)
+        if pred in self.kb.static_pred_idxs:
+            pos = self.kb.query_static_array(tuple([pred] + [None if idx in var_positions else node.children[idx].idx
+                                                             for idx in range(len(node.children))]), domain)
+            return pos, 1.0 - pos
+        if self.kb.get_perceptual_pidx(pred) is not None:
+            # perceptual predicates are all unary p(x) for x an object, p a predicate
+            if len(node.children) != 1 or True in [self.kb.get_atom_oidx(idx) is None for idx in domain]:
+                return None
+            if len(domain) == 0:
+                return np.zeros(0), np.zeros(0)
+            confs = self.kb.query_perceptual_array(pred, domain)
+            return confs[:, 0], confs[:, 1]
+        return np.zeros(len(domain)), np.ones(len(domain))  # unknown preds are confidently false
+
+    # Given a tree, a lambda name, and an assignment, return a tree with all lambdas of that name instantiated to
+    # the assignment. The given tree is not modified; only nodes on the path to an instantiated lambda are copied,
+    # and every other subtree is shared with it.
     def instantiate_lambda(self, root, name, assignment):
         debug = False
         if debug:
             print ("instantiate_lambda called for " + self.parser.print_parse(root) + ", " + str(name) +
                    ", " + str(assignment))
 
-        to_process = [root]
-        while len(to_process) > 0:
-            n = to_process.pop()
-            if n.is_lambda and n.lambda_name == name:
-                n.is_lambda = False
-                n.lambda_name = None
-                n.idx = assignment
-            if n.children is not None:
-                to_process.extend(n.children)
+        children = None
+        if root.children is not None:
+            children = [self.instantiate_lambda(c, name, assignment) for c in root.children]
+        if root.is_lambda and root.lambda_name == name:
+            n = copy.copy(root)
+            n.is_lambda = False
+            n.lambda_name = None
+            n.idx = assignment
+            n.children = children
+        elif children is not None and len([idx for idx in range(len(children))
+                                           if children[idx] is not root.children[idx]]) > 0:
+            n = copy.copy(root)
+            n.children = children
+        else:
+            n = root
+        if n is not root and self.grounding_profile is not None:
+            self.grounding_profile['copies'] += 1
 
         if debug:
-            print("instantiate_lambda: produced " + self.parser.print_parse(root))
+            print("instantiate_lambda: produced " + self.parser.print_parse(n))
+        return n
+
+    # Given a lambda instantiation root and candidate assignments to its lambda, return those assignments that could
+    # make root's body True, in order.
+    # Each conjunct of the body (its children if it is an 'and', else the body itself) that is a KB predicate over
+    # the lambda and constants constrains the assignments: static predicates to the atoms their facts bind at the
+    # lambda's positions, via the KB index, and other predicates to the atoms whose query confidence is above
+    # assignment_conf_threshold. Other conjuncts are left for grounding to decide.
+    def prune_assignments(self, root, assignments):
+        debug = False
+
+        body = root.children[0]
+        conjuncts = body.children if body.children is not None and self.is_logical(body.idx, 'and') else [body]
+        for conjunct in conjuncts:
+            if (conjunct.children is None or conjunct.is_lambda_instantiation or
+                    True in [self.is_logical(conjunct.idx, l) for l in ['equals', 'and', 'or', 'the', 'a']]):
+                continue
+            conjunct.set_return_type(self.parser.ontology)
+            if conjunct.return_type != self.parser.ontology.types.index('t'):
+                continue
+            var_positions = [idx for idx in range(len(conjunct.children))
+                             if conjunct.children[idx].is_lambda and
+                             conjunct.children[idx].lambda_name == root.lambda_name]
+            constants = [c for c in conjunct.children if not c.is_lambda]
+            if (len(var_positions) == 0 or len(var_positions) + len(constants) < len(conjunct.children) or
+                    True in [c.children is not None for c in constants]):
+                continue
+
+            # Grounding issues no queries with objects outside the active test set, so nothing can satisfy them.
+            for c in constants:
+                oidx = self.kb.get_atom_oidx(c.idx)
+                if oidx is not None and oidx not in self.active_test_set:
+                    assignments = []
+
+            if conjunct.idx in self.kb.static_pred_idxs:
+                pattern = tuple([conjunct.idx] + [None if idx in var_positions else conjunct.children[idx].idx
+                                                  for idx in range(len(conjunct.children))])
+                bound = set([b[0] for b in self.kb.query_pattern_idxs(pattern) if len(set(b)) == 1])
+                assignments = [a for a in assignments if a in bound]
+            else:
+                plausible = []
+                for a in assignments:
+                    q = tuple([conjunct.idx] + [a if idx in var_positions else conjunct.children[idx].idx
+                                                for idx in range(len(conjunct.children))])
+                    if self.kb.query_idxs(q)[0] > self.assignment_conf_threshold:
+                        plausible.append(a)
+                assignments = plausible
+            if debug:
+                print("prune_assignments: " + self.parser.print_parse(conjunct) + " leaves " + str(len(assignments)) +
+                      " assignments")
+
+        return assignments
 
     # returns all possible ontological assignments to lambdas of a given type
     def assignments_for_type(self, t):
         return [idx for idx in range(len(self.parser.ontology.preds))
                 if (self.parser.ontology.entries[idx] == t and
-                    (self.parser.ontology.types[t] != 'i'
-                     or int(self.parser.ontology.preds[idx].split('_')[1]) in self.active_test_set))]
+                    (self.parser.ontology.types[t] != 'i' or self.kb.get_atom_oidx(idx) in self.active_test_set))]
 
     # determine whether a predicate is logical
     def is_logical(self, idx, logical_root):
@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 __author__ = 'jesse'
 
+import hashlib
 import itertools
+import numpy as np
+import os
 import PerceptionClassifiers
+import pickle
 
 
 # Load and store static facts from file. These facts can be created by hand or generated by another
@@ -14,9 +18,23 @@ class KnowledgeBase:
 
     # Initialize given a facts filename.
     def __init__(self, static_facts_fn, perception_source_dir, perception_feature_dir, active_test_set,
-                 ontology, behaviors=None, modalities=None):
+                 ontology, behaviors=None, modalities=None, training_workers=1, kappa_mode='exact',
+                 online_updates=False, classifier_backend='svc'):
         self.static_facts = None
         self.static_preds = None
+        self.static_pred_idxs = None  # set of ontology idxs of static_preds
+        self.facts_by_pred = None  # pred idx -> set of static fact tuples with that predicate
+        self.facts_by_arg = None  # (pred idx, argument position, atom idx) -> set of static fact tuples
+        self.commutative_pred_idxs = None  # set of ontology idxs of predicates whose facts are stored canonically
+        self.pred_idxs = None  # dict from ontology pred names to their (first) idxs
+        self.num_pred_idxs = None  # int; how many ontology entries pred_idxs covers
+        self.atom_oidxs = None  # dict from ontology idxs to the oidx of 'oidx_N' atoms, or None for other entries
+        self.perceptual_pidxs = None  # dict from ontology idxs of perceptual predicates to their pc pidxs
+        self.static_pred_versions = None  # dict from static pred idxs to ints bumped whenever their facts change
+        self.query_cache = {}  # dict from ontology idx queries to (predicate version, query_idxs result) tuples
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+        self.static_array_cache = {}  # dict from (pattern, domain) to (predicate version, query_static_array result)
         self.perceptual_preds = None
         self.ontology = ontology
 
@@ -28,46 +46,83 @@ class KnowledgeBase:
         self.active_test_set = active_test_set
         self.pc = PerceptionClassifiers.PerceptionClassifiers(perception_source_dir, perception_feature_dir,
                                                               active_test_set, kernel='linear',
-                                                              behaviors=behaviors, modalities=modalities)
+                                                              behaviors=behaviors, modalities=modalities,
+                                                              training_workers=training_workers,
+                                                              kappa_mode=kappa_mode, online_updates=online_updates,
+                                                              classifier_backend=classifier_backend)
         self.perceptual_preds = self.pc.predicates  # Should make perceptual_preds a reference for pc preds.
 
     # Read in facts from file.
     # Fact format is 'predicate(arg1, arg2, ...)'
-    # If a predicate is prefixed with a '*' it is treated as symmetric, e.g. "*beside(a,b)" adds "beside(b,a)"
+    # If a predicate is prefixed with a '*' in the ontology it is treated as symmetric, e.g. "beside(a,b)" also
+    # makes "beside(b,a)" true; such facts are stored once with their arguments sorted (see get_canonical_fact)
     # Facts not present in the facts file are considered false (closed-world assumption)
+    # Facts are read from the compiled file next to fn when it is up to date, and otherwise parsed from fn and
+    # compiled for the next load (see compile_static_facts).
     def extract_facts_from_file(self, fn):
-        self.static_facts = set()  # tuples (pred, arg1, arg2, ..., argN) each with arbitrary N
+        self.static_facts = set()  # tuples of ontology idxs (pred, arg1, arg2, ..., argN) each with arbitrary N
         self.static_preds = set()
+        self.static_pred_idxs = set()
+        self.facts_by_pred = {}
+        self.facts_by_arg = {}
+        self.commutative_pred_idxs = set(self.ontology.commutative)
+        self.pred_idxs = {}
+        self.num_pred_idxs = 0
+        self.atom_oidxs = {}
+        self.perceptual_pidxs = {}
+        self.static_pred_versions = {}
 
-        with open(fn, 'r') as f:
-            for line in f.readlines():
-
-                l = line.strip()
-                if len(l) == 0 or l[0] == '#':
-                    continue
-                if l.count('(') != 1 or l.count(')') != 1:
-                    print("WARNING: unreadable fact '" + str(l) + "' parens errors")
-                    continue
-
-                p = l.split('(')
-                pred = p[0]
-                args = [a.strip() for a in p[1].strip(')').split(',')]
-
-                # Validate against ontology.
-                if pred not in self.ontology.preds:
-                    raise ValueError("predicate '" + pred + "' in static facts not found in ontology")
-                for a in args:
-                    if a not in self.ontology.preds:
-                        raise ValueError("argument '" + a + "' in static facts not found in ontology")
-
-                # Add the fact commutatively (with all argument permutations).
-                if self.ontology.preds.index(pred) in self.ontology.commutative:
-                    for perm_idxs in itertools.permutations(range(len(args))):
-                        self.static_facts.add(tuple([pred] + [args[idx] for idx in perm_idxs]))
-                # Add the fact with arguments in-place.
-                else:
-                    self.static_facts.add(tuple([pred] + args))
-                self.static_preds.add(pred)
+        facts = load_compiled_static_facts(fn, self.ontology)
+        if facts is None:
+            facts = compile_static_facts(fn, self.ontology)
+        for arity in facts:
+            for row in facts[arity].tolist():
+                self.index_static_fact(tuple(row))
+                self.static_pred_idxs.add(row[0])
+        self.static_preds = set([self.ontology.preds[idx] for idx in self.static_pred_idxs])
+        for idx in range(len(self.ontology.preds)):
+            self.get_atom_oidx(idx)
+
+    # Returns the ontology idx of a pred name, or None if the ontology has no such entry.
+    # The name map is extended lazily since agents add entries to the ontology as they learn new words.
+    def get_pred_idx(self, name):
+        if name not in self.pred_idxs and self.num_pred_idxs < len(self.ontology.preds):
+            for idx in range(self.num_pred_idxs, len(self.ontology.preds)):
+                if self.ontology.preds[idx] not in self.pred_idxs:
+                    self.pred_idxs[self.ontology.preds[idx]] = idx
+            self.num_pred_idxs = len(self.ontology.preds)
+        return self.pred_idxs.get(name)
+
+    # Returns the oidx an ontology atom idx names, for atoms named 'oidx_N', or None for any other entry.
+    def get_atom_oidx(self, idx):
+        if idx not in self.atom_oidxs:
+            name = self.ontology.preds[idx]
+            self.atom_oidxs[idx] = int(name.split('_')[1]) if 'oidx' in name else None
+        return self.atom_oidxs[idx]
+
+    # Returns the pc pidx of the perceptual predicate with the given ontology idx, or None if it is not perceptual.
+    def get_perceptual_pidx(self, idx):
+        if idx not in self.perceptual_pidxs:
+            name = self.ontology.preds[idx]
+            if name not in self.perceptual_preds:
+                return None  # not cached, since perceptual predicates are added as they are learned
+            self.perceptual_pidxs[idx] = self.perceptual_preds.index(name)
+        return self.perceptual_pidxs[idx]
+
+    # Returns the ontology idx tuple of a fact given as pred name strs, or None if it names something the
+    # ontology lacks.
+    def get_fact_idxs(self, f):
+        if self.ontology is None:
+            return None
+        idxs = tuple([self.get_pred_idx(a) for a in f])
+        return None if None in idxs else idxs
+
+    # Returns the form an ontology idx fact is stored and looked up in: the fact itself, or for commutative
+    # predicates, the fact with its arguments sorted so that every argument permutation maps to the same tuple.
+    def get_canonical_fact(self, f):
+        if f[0] in self.commutative_pred_idxs:
+            return tuple([f[0]] + sorted(f[1:]))
+        return f
 
     # Query fact structures.
     # q is a fact query in the form (pred, arg1, arg2, ..., argN)
@@ -77,14 +132,16 @@ class KnowledgeBase:
         assert type(q) is tuple
         debug = False
 
+        idxs = self.get_fact_idxs(q)
+        if idxs is not None:
+            return self.query_idxs(idxs)
+
+        # The query names something outside the ontology, so it can only be answered perceptually.
         pred = q[0]
-        if pred in self.static_preds:
+        if self.static_preds is not None and pred in self.static_preds:
             if debug:
-                print("query: pred '" + pred + "' is static")
-            if q in self.static_facts:
-                return 1.0, 0.0
-            else:
-                return 0.0, 1.0
+                print("query: pred '" + pred + "' is static but its arguments are not in the ontology")
+            return 0.0, 1.0
         elif pred in self.perceptual_preds:
             if debug:
                 print("query: pred '" + pred + "' is perceptual")
@@ -97,13 +154,253 @@ class KnowledgeBase:
                 print("query: pred '" + pred + "' is unknown; returning full false confidence")
             return 0.0, 1.0  # return confident false by closed-world assumption
 
+    # Query fact structures with a fact given as ontology idxs (pred, arg1, arg2, ..., argN) rather than strs.
+    # Returns the same pos_conf, neg_conf tuple as query.
+    # Answers are memoized alongside the version of the predicate they were computed at, which is bumped when a
+    # static predicate's facts are added or removed and when the classifiers retrain or relabel a perceptual one,
+    # so a memoized answer is reused exactly until its predicate changes.
+    def query_idxs(self, q):
+        debug = False
+
+        pred = q[0]
+        pidx = None
+        if pred in self.static_pred_idxs:
+            version = self.static_pred_versions.get(pred, 0)
+        else:
+            pidx = self.get_perceptual_pidx(pred)
+            if pidx is None:  # pred doesn't appear in static facts or in known perceptual preds
+                if debug:
+                    print("query_idxs: pred " + str(pred) + " is unknown; returning full false confidence")
+                self.query_cache_misses += 1  # answered without the memo, but still a query issued
+                return 0.0, 1.0  # return confident false by closed-world assumption
+            version = self.pc.predicate_versions[pidx]
+        if q in self.query_cache and self.query_cache[q][0] == version:
+            self.query_cache_hits += 1
+            return self.query_cache[q][1]
+        self.query_cache_misses += 1
+
+        if pidx is None:
+            if debug:
+                print("query_idxs: pred " + str(pred) + " is static")
+            if self.get_canonical_fact(q) in self.static_facts:
+                result = 1.0, 0.0
+            else:
+                result = 0.0, 1.0
+        else:
+            if debug:
+                print("query_idxs: pred " + str(pred) + " is perceptual")
+            # perceptual predicates are all unary p(x) for x an object, p a predicate
+            result = self.pc.run_classifier(pidx, self.get_atom_oidx(q[1]))
+        self.query_cache[q] = (version, result)
+        return result
+
+    # Returns a hashable version of everything queries are answered from, which changes whenever a static fact is
+    # added or removed, a perceptual predicate is added, or a perception classifier is retrained or relabeled.
+    def get_version(self):
+        return sum(self.static_pred_versions.values()), len(self.pc.predicates), sum(self.pc.predicate_versions)
+
+    # Returns the query memo's hit and miss counts since the last reset and its current number of entries.
+    def get_query_cache_stats(self):
+        return {'hits': self.query_cache_hits, 'misses': self.query_cache_misses, 'size': len(self.query_cache)}
+
+    # Empties the query memo and zeroes its counters.
+    def reset_query_cache(self):
+        self.query_cache = {}
+        self.static_array_cache = {}
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+
+    # Query perceptual predicates against objects in bulk.
+    # preds is a list of perceptual predicate strs and oidxs a list of object idxs
+    # Returns a numpy array of shape (len(preds), len(oidxs), 2) whose [i, j] entry is the pos_conf, neg_conf
+    # tuple query((preds[i], 'oidx_' + str(oidxs[j]))) would return
+    def query_perceptual_batch(self, preds, oidxs):
+        for pred in preds:
+            if (self.static_preds is not None and pred in self.static_preds) or pred not in self.perceptual_preds:
+                raise ValueError("predicate '" + str(pred) + "' is not perceptual")
+        return self.pc.run_classifiers_batch([self.pc.predicates.index(pred) for pred in preds], oidxs)
+
+    # Query a static predicate over a domain of atoms in bulk.
+    # pattern is a tuple of ontology idxs (pred, arg1, ..., argN) where at least one argument is None, and domain a
+    # list of atom ontology idxs each of which is put at every None position of the pattern in turn.
+    # Returns a numpy array of len(domain) whose entries are the pos_conf query_idxs would return for those facts.
+    # Results are memoized like query_idxs results; callers must not modify the returned array.
+    def query_static_array(self, pattern, domain):
+        pred = pattern[0]
+        version = self.static_pred_versions.get(pred, 0)
+        key = (pattern, tuple(domain))
+        if key in self.static_array_cache and self.static_array_cache[key][0] == version:
+            return self.static_array_cache[key][1]
+
+        bound = set([b[0] for b in self.query_pattern_idxs(pattern) if len(set(b)) == 1])
+        result = np.array([1.0 if idx in bound else 0.0 for idx in domain])
+        self.static_array_cache[key] = (version, result)
+        return result
+
+    # Query a unary perceptual predicate over a domain of object atoms in bulk.
+    # pred is the ontology idx of a perceptual predicate and domain a list of 'oidx_N' atom ontology idxs.
+    # Returns a numpy array of shape (len(domain), 2) whose rows are the pos_conf, neg_conf tuples query_idxs
+    # would return for (pred, atom).
+    def query_perceptual_array(self, pred, domain):
+        pidx = self.get_perceptual_pidx(pred)
+        if pidx is None:
+            raise ValueError("predicate '" + str(self.ontology.preds[pred]) + "' is not perceptual")
+        return self.pc.run_classifiers_batch([pidx], [self.get_atom_oidx(idx) for idx in domain])[0]
+
+    # Query static facts against a pattern with wildcards.
+    # pattern is a tuple (pred, arg1, ..., argN) where any argument may be None to match any atom, e.g.
+    # ('possesses', None, 'oidx_3'); only facts with the same number of arguments as the pattern match.
+    # Returns a sorted list of binding tuples, one per matching fact, holding that fact's atoms at the None
+    # positions of the pattern in order. Each distinct argument permutation of a commutative fact counts as a fact.
+    def query_pattern(self, pattern):
+        assert type(pattern) is tuple
+        idxs = self.get_fact_idxs(tuple([a for a in pattern if a is not None]))
+        if idxs is None:
+            return []
+        idxs = list(idxs)
+        pattern_idxs = tuple([idxs.pop(0) if a is not None else None for a in pattern])
+        return sorted([tuple([self.ontology.preds[idx] for idx in b])
+                       for b in self.query_pattern_idxs(pattern_idxs)])
+
+    # Like query_pattern for a pattern of ontology idxs, returning bindings of ontology idxs in no particular order.
+    def query_pattern_idxs(self, pattern):
+        pred = pattern[0]
+        if self.facts_by_pred is None or pred not in self.facts_by_pred:
+            return []
+
+        # Intersect the index entries for every ground argument, smallest first.
+        candidates = [self.facts_by_arg.get((pred, self.get_arg_position(pred, idx), pattern[idx]), set())
+                      for idx in range(1, len(pattern)) if pattern[idx] is not None]
+        if len(candidates) > 0:
+            candidates.sort(key=len)
+            matches = candidates[0].intersection(*candidates[1:])
+        else:
+            matches = self.facts_by_pred[pred]
+        matches = [f for f in matches if len(f) == len(pattern)]
+        if pred in self.commutative_pred_idxs:
+            matches = [tuple([pred] + list(perm)) for f in matches for perm in set(itertools.permutations(f[1:]))
+                       if False not in [pattern[idx] is None or pattern[idx] == perm[idx - 1]
+                                        for idx in range(1, len(pattern))]]
+
+        wildcards = [idx for idx in range(1, len(pattern)) if pattern[idx] is None]
+        return [tuple([f[idx] for idx in wildcards]) for f in matches]
+
+    # The position facts_by_arg indexes a predicate's argument idx under; None (any position) for commutative
+    # predicates, whose stored argument order says nothing about the order they are queried in.
+    def get_arg_position(self, pred, idx):
+        return None if pred in self.commutative_pred_idxs else idx
+
     # Add additional fact.
+    # ValueError will be raised if f names something not in the ontology.
     def add_static_fact(self, f):
         assert type(f) is tuple
-        self.static_facts.add(f)
+        idxs = self.get_fact_idxs(f)
+        if idxs is None:
+            raise ValueError("static fact " + str(f) + " names something not found in ontology")
+        self.index_static_fact(idxs)
 
     # Remove fact.
     # KeyError will be raised if f is not in facts.
     def remove_static_fact(self, f):
         assert type(f) is tuple
+        idxs = self.get_fact_idxs(f)
+        if idxs is None:
+            raise KeyError(f)
+        f = self.get_canonical_fact(idxs)
         self.static_facts.remove(f)
+        self.static_pred_versions[f[0]] = self.static_pred_versions.get(f[0], 0) + 1
+        self.facts_by_pred[f[0]].remove(f)
+        for idx in range(1, len(f)):
+            key = (f[0], self.get_arg_position(f[0], idx), f[idx])
+            if f in self.facts_by_arg[key]:  # repeated atoms of commutative facts share a key
+                self.facts_by_arg[key].remove(f)
+                if len(self.facts_by_arg[key]) == 0:
+                    del self.facts_by_arg[key]
+
+    # Add an ontology idx fact to the static facts and their indexes.
+    def index_static_fact(self, f):
+        f = self.get_canonical_fact(f)
+        self.static_facts.add(f)
+        self.static_pred_versions[f[0]] = self.static_pred_versions.get(f[0], 0) + 1
+        if f[0] not in self.facts_by_pred:
+            self.facts_by_pred[f[0]] = set()
+        self.facts_by_pred[f[0]].add(f)
+        for idx in range(1, len(f)):
+            key = (f[0], self.get_arg_position(f[0], idx), f[idx])
+            if key not in self.facts_by_arg:
+                self.facts_by_arg[key] = set()
+            self.facts_by_arg[key].add(f)
+
+
+# The compiled form of a static facts file, written next to it.
+def get_compiled_facts_fn(fn):
+    return fn + ".compiled"
+
+
+# A hash of the ontology entries compiled facts index into, so facts compiled against a different ontology
+# are recognized as stale.
+def get_ontology_signature(ontology):
+    return hashlib.sha1(repr([ontology.preds, sorted(ontology.commutative)]).encode('utf-8')).hexdigest()
+
+
+# Parse and validate a static facts file against the ontology and write its compiled form.
+# Returns a dictionary from fact arity (counting the predicate) to an int32 array whose rows are the ontology
+# pred idxs of the predicate and arguments of each fact with that arity, in file order.
+def compile_static_facts(fn, ontology):
+    pred_idxs = {ontology.preds[idx]: idx for idx in range(len(ontology.preds))}
+    rows = {}
+    with open(fn, 'r') as f:
+        for line in f.readlines():
+
+            l = line.strip()
+            if len(l) == 0 or l[0] == '#':
+                continue
+            if l.count('(') != 1 or l.count(')') != 1:
+                print("WARNING: unreadable fact '" + str(l) + "' parens errors")
+                continue
+
+            p = l.split('(')
+            pred = p[0]
+            args = [a.strip() for a in p[1].strip(')').split(',')]
+
+            # Validate against ontology.
+            if pred not in pred_idxs:
+                raise ValueError("predicate '" + pred + "' in static facts not found in ontology")
+            for a in args:
+                if a not in pred_idxs:
+                    raise ValueError("argument '" + a + "' in static facts not found in ontology")
+
+            row = [pred_idxs[pred]] + [pred_idxs[a] for a in args]
+            if len(row) not in rows:
+                rows[len(row)] = []
+            rows[len(row)].append(row)
+    facts = {arity: np.array(rows[arity], dtype=np.int32) for arity in rows}
+
+    # Write to a temporary file and move it into place so concurrent agents never read a partial file.
+    source_stat = os.stat(fn)
+    compiled_fn = get_compiled_facts_fn(fn)
+    tmp_fn = compiled_fn + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(tmp_fn, 'wb') as f:
+            pickle.dump({'source_mtime': source_stat.st_mtime, 'source_size': source_stat.st_size,
+                         'ontology': get_ontology_signature(ontology), 'facts': facts},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_fn, compiled_fn)
+    except (IOError, OSError):
+        print("WARNING: unable to write compiled static facts to '" + compiled_fn + "'")
+    return facts
+
+
+# Read the compiled form of a static facts file as compile_static_facts returns it, or None if there is none or
+# it is stale because the facts file or ontology changed since it was compiled.
+def load_compiled_static_facts(fn, ontology):
+    compiled_fn = get_compiled_facts_fn(fn)
+    if not os.path.isfile(compiled_fn):
+        return None
+    with open(compiled_fn, 'rb') as f:
+        compiled = pickle.load(f)
+    source_stat = os.stat(fn)
+    if (compiled['source_mtime'] != source_stat.st_mtime or compiled['source_size'] != source_stat.st_size or
+            compiled['ontology'] != get_ontology_signature(ontology)):
+        return None
+    return compiled['facts']
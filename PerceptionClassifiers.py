@@ -1,9 +1,16 @@
 #!/usr/bin/env python
 __author__ = 'jesse'
 
+import FeatureStore
+import hashlib
+import multiprocessing
 import numpy as np
 import os
 import pickle
+import time
+from sklearn.linear_model import LogisticRegression
+from sklearn.neighbors import NearestCentroid
+from sklearn.svm import LinearSVC
 from sklearn.svm import SVC
 
 
@@ -11,8 +18,13 @@ class PerceptionClassifiers:
 
     def __init__(self, source_dir, feature_dir, active_test_set,
                  kernel='linear',
+                 classifier_backend='svc',
                  behaviors=None,
                  modalities=None,
+                 training_workers=1,
+                 kappa_mode='exact',
+                 online_updates=False,
+                 cache_max_age_days=30,
                  debug=False):
 
         # Initialization parameters.
@@ -20,20 +32,39 @@ class PerceptionClassifiers:
         self.feature_dir = feature_dir  # str; expects oidxs.pickle, features.pickle for objects
         self.active_test_set = active_test_set  # list of int; oidxs' labels to be excluded from SVM training/test
         self.kernel = kernel  # str
+        self.classifier_backend = classifier_backend  # str; key into classifier_backends
+        self.training_workers = training_workers  # int; processes to spread (predicate, context) fits over
+        self.kappa_mode = kappa_mode  # str; 'exact' or 'support' leave-one-object-out kappa estimation
+        self.online_updates = online_updates  # bool; fold new labels into linear classifiers instead of refitting
+        self.pending_retrain_pidxs = []  # list of pidxs updated online and awaiting a full refit
+        self.cache_max_age_days = cache_max_age_days  # float; unused classifier cache entries are pruned after this
 
         self.predicates = None  # list of strs
         self.oidxs = None  # list of ints
         self.labels = None  # list of (pidx, oidx, label) triples for label in {False, True}
-        self.features = None  # list of behavior, modality indexed dictionaries into lists of observation vectors
+        self.label_counts = None  # pidx -> oidx -> [neg, pos] label tallies for oidxs outside the active test set
+        self.features = None  # FeatureStore of observation vectors per object and behavior, modality context
         self.behaviors = None  # list of strs
         self.contexts = None  # list of (behavior, modality) str tuples
         self.classifiers = None  # list of behavior, modality indexed dictionaries into SVC classifiers
         self.kappas = None  # list of behavior, modality indexed dictionaries into [0, 1] floats
         self.weights = None  # list of behavior, modality indexed dictionaries into [0, 1] confidences summing to 1
-
-        self.classifiers_fn = "classifiers_" + '_'.join([str(oidx) for oidx in active_test_set]) + ".pickle"
+        self.oidx_columns = None  # dict from oidxs to their columns in the confidence matrix
+        self.confidences = None  # pidx x oidx column x (pos_conf, neg_conf) numpy array of run_classifier results
+        self.predicate_versions = None  # list of ints per pidx; bumped whenever a predicate is retrained or relabeled
+        self.confidence_versions = None  # list of ints per pidx; the predicate version its confidence row reflects
+        self.linear_weights = None  # behavior, modality indexed dictionaries into pidx x feature weight arrays
+        self.linear_biases = None  # behavior, modality indexed dictionaries into pidx bias vectors
+        self.linear_pidxs = None  # pidx bool array; whether a predicate's classifiers are compiled into the above
+        self.context_fingerprints = None  # list of strs per context; hashes of the features classifiers are fit on
+
+        if self.classifier_backend not in classifier_backends:
+            raise ValueError("unknown classifier backend '" + str(self.classifier_backend) + "'; expected one of " +
+                             str(sorted(classifier_backends.keys())))
+
+        self.cache_dir = os.path.join(self.source_dir, "classifier_cache")
         if debug:
-            print("classifiers_fn = " + self.classifiers_fn)
+            print("cache_dir = " + self.cache_dir)
 
         # Read in source information.
         if debug:
@@ -49,15 +80,18 @@ class PerceptionClassifiers:
         labels_fn = os.path.join(self.source_dir, "labels.pickle")
         if os.path.isfile(labels_fn):
             with open(labels_fn, 'rb') as f:
-                self.labels = pickle.load(f)
+                self.set_labels(pickle.load(f))
         else:
             print ("WARNING: python_classifier_services unable to load " +
                    str(labels_fn) + "; starting with blank labels list")
-            self.labels = []
+            self.set_labels([])
         with open(os.path.join(self.feature_dir, "oidxs.pickle"), 'rb') as f:
             self.oidxs = pickle.load(f)
-        with open(os.path.join(self.feature_dir, "features.pickle"), 'rb') as f:
-            self.features = pickle.load(f)
+        self.oidx_columns = {self.oidxs[jdx]: jdx for jdx in range(len(self.oidxs))}
+        self.confidences = np.zeros((len(self.predicates), len(self.oidxs), 2))
+        self.predicate_versions = [0 for _ in range(len(self.predicates))]
+        self.confidence_versions = [-1 for _ in range(len(self.predicates))]
+        self.features = FeatureStore.load_feature_store(self.feature_dir)
         if behaviors is None:
             self.behaviors = ["drop", "grasp", "hold", "lift", "look", "lower", "press", "push"]
         else:
@@ -71,27 +105,35 @@ class PerceptionClassifiers:
         self.contexts = []
         for b in self.behaviors:
             self.contexts.extend([(b, m) for m in self.modalities
-                                  if m in self.features[self.oidxs[0]][b].keys()])
+                                  if self.features.has_context(self.oidxs[0], b, m)])
+        self.linear_weights = {b: {m: np.zeros((len(self.predicates), self.features.arrays[b][m].shape[1]))
+                                   for _b, m in self.contexts if b == _b}
+                               for b in self.behaviors}
+        self.linear_biases = {b: {m: np.zeros(len(self.predicates)) for _b, m in self.contexts if b == _b}
+                              for b in self.behaviors}
+        self.linear_pidxs = np.zeros(len(self.predicates), dtype=bool)
         if debug:
             print("... done")
 
-        # Read in cashed classifiers or train fresh ones.
-        classifier_fn = os.path.join(source_dir, self.classifiers_fn)
-        if os.path.isfile(classifier_fn):
-            if debug:
-                print("reading cached classifiers from file...")
-            with open(classifier_fn, 'rb') as f:
-                self.classifiers, self.kappas = pickle.load(f)
-                self.weights = [self.get_weight_from_kappa(pidx) for pidx in range(len(self.predicates))]
-        else:
-            if debug:
-                print("training classifiers from source information...")
-            self.classifiers = [None for _ in range(len(self.predicates))]  # pidx, b, m
-            self.kappas = [{b: {m: 0 for _b, m in self.contexts if b == _b}
-                            for b in self.behaviors}
-                           for _ in range(len(self.predicates))]
-            self.weights = [self.get_weight_from_kappa(pidx) for pidx in range(len(self.predicates))]
-            self.train_classifiers(range(len(self.predicates)))
+        # Read in cached classifiers and train fresh ones for the rest.
+        # Classifiers are cached per predicate under a hash of everything their training depends on, so only
+        # predicates whose labels, backend, kernel, kappa mode, or context features changed since caching are retrained.
+        self.context_fingerprints = [self.features.get_fingerprint(b, m) for b, m in self.contexts]
+        self.classifiers = [None for _ in range(len(self.predicates))]  # pidx, b, m
+        self.kappas = [{b: {m: 0 for _b, m in self.contexts if b == _b}
+                        for b in self.behaviors}
+                       for _ in range(len(self.predicates))]
+        retrain_pidxs = [pidx for pidx in range(len(self.predicates)) if not self.load_cached_classifier(pidx)]
+        if len(retrain_pidxs) > 0:
+            retrain_pidxs = self.migrate_legacy_classifiers(retrain_pidxs, debug=debug)
+        self.weights = [self.get_weight_from_kappa(pidx) for pidx in range(len(self.predicates))]
+        if debug:
+            print("read " + str(len(self.predicates) - len(retrain_pidxs)) + " predicates' classifiers from " +
+                  "cache; training " + str(len(retrain_pidxs)) + " from source information...")
+        self.train_classifiers(retrain_pidxs)
+        for pidx in retrain_pidxs:
+            self.save_cached_classifier(pidx)
+        self.refresh_confidences(range(len(self.predicates)))
         if debug:
             print("... done;")
             for pidx in range(len(self.predicates)):
@@ -104,48 +146,139 @@ class PerceptionClassifiers:
         return {b: {m: self.kappas[pidx][b][m] / float(s) if s > 0 else 1.0 / len(self.contexts)
                 for _b, m in self.contexts if b == _b} for b in self.behaviors}
 
+    # Replace the list of (pidx, oidx, label) triples and rebuild the label tallies from it.
+    # Code that swaps out labels (e.g., to blind objects for cross validation) should go through here
+    # rather than assigning self.labels directly so that the tallies stay in sync.
+    def set_labels(self, labels):
+        self.labels = labels
+        self.label_counts = {}
+        for pidx, oidx, l in self.labels:
+            self.tally_label(pidx, oidx, l)
+        if self.predicate_versions is not None:
+            self.invalidate_confidences(range(len(self.predicates)))
+
+    # Record a (pidx, oidx, label) triple in the label tallies; labels of active test set objects are ignored.
+    def tally_label(self, pidx, oidx, l):
+        if oidx in self.active_test_set:
+            return
+        if pidx not in self.label_counts:
+            self.label_counts[pidx] = {}
+        if oidx not in self.label_counts[pidx]:
+            self.label_counts[pidx][oidx] = [0, 0]
+        self.label_counts[pidx][oidx][1 if l else 0] += 1
+
+    # Returns a [neg, pos] count of the labels for the given predicate on the given object, or summed
+    # across all objects outside the active test set if oidx is None.
+    def get_label_counts(self, pidx, oidx=None):
+        if pidx not in self.label_counts:
+            return [0, 0]
+        if oidx is not None:
+            return self.label_counts[pidx][oidx][:] if oidx in self.label_counts[pidx] else [0, 0]
+        return [sum([c[0] for c in self.label_counts[pidx].values()]),
+                sum([c[1] for c in self.label_counts[pidx].values()])]
+
     # Gets the result of specified predicate on specified object.
     # Takes in a predicate idx and object idx
     # Returns a tuple of pos_conf, neg_conf for confidence in [0, 1] that the label does or does not apply
     # pos_conf + neg_conf = 1.0 unless pos_conf = neg_conf = 0
+    # Raises KeyError if oidx has no features.
     def run_classifier(self, pidx, oidx):
         debug = False
 
-        # Check existing labels.
-        ls = [l for _p, _o, l in self.labels if _p == pidx and _o == oidx and _o not in self.active_test_set]
-        if len(ls) > 0:
-            # This object is already labeled.
-            if debug:
-                print ("returning Laplace-1 smoothed class balance for seen pred '" + self.predicates[pidx] +
-                       "' on object " + str(oidx))
-            pos_conf = (1 + ls.count(1)) / float(len(ls) + 2)
-            neg_conf = (1 + ls.count(0)) / float(len(ls) + 2)
-        else:
-
-            # Run classifiers if trained.
-            if self.classifiers[pidx] is not None:
-                if debug:
-                    print("running classifier '" + self.predicates[pidx] + "' on object " + str(oidx))
-                pos_conf = 0
-                neg_conf = 0
-                for b, m in self.contexts:
-                    x, y, z = get_classifier_results(self.classifiers[pidx][b][m], b, m,
-                                                     [(oidx, None)], self.features, self.kernel, None)
-                    for v in z:
-                        if v == 1:
-                            pos_conf += self.weights[pidx][b][m] / float(len(z))
-                        elif v == -1:
-                            neg_conf += self.weights[pidx][b][m] / float(len(z))
-            else:
-                if debug:
-                    print("classifier '" + self.predicates[pidx] + "' is untrained")
-                pos_conf = 0.5  # confidences are equally uncertain
-                neg_conf = 0.5
+        if oidx not in self.oidx_columns:
+            raise KeyError(oidx)
+        if self.confidence_versions[pidx] != self.predicate_versions[pidx]:
+            self.refresh_confidences([pidx])
+        pos_conf, neg_conf = self.confidences[pidx, self.oidx_columns[oidx]]
 
         # Prepare and send response.
         if debug:
             print("... returning pos_conf " + str(pos_conf) + " and neg_conf " + str(neg_conf))
-        return pos_conf, neg_conf
+        return float(pos_conf), float(neg_conf)
+
+    # Gets the results of several predicates on several objects at once.
+    # Takes in a list of predicate idxs and a list of object idxs
+    # Returns a numpy array of shape (len(pidxs), len(oidxs), 2) whose [i, j] entry holds the pos_conf, neg_conf
+    # that run_classifier(pidxs[i], oidxs[j]) returns.
+    # Raises KeyError if any oidx has no features.
+    def run_classifiers_batch(self, pidxs, oidxs):
+        for oidx in oidxs:
+            if oidx not in self.oidx_columns:
+                raise KeyError(oidx)
+        stale = [pidx for pidx in pidxs if self.confidence_versions[pidx] != self.predicate_versions[pidx]]
+        if len(stale) > 0:
+            self.refresh_confidences(list(set(stale)))
+        return self.confidences[np.ix_(list(pidxs), [self.oidx_columns[oidx] for oidx in oidxs])]
+
+    # Marks the confidence matrix rows of the given predicates as stale by bumping their versions.
+    def invalidate_confidences(self, pidxs):
+        for pidx in pidxs:
+            self.predicate_versions[pidx] += 1
+
+    # Recomputes the confidence matrix rows of the given predicates against every object and marks them current.
+    def refresh_confidences(self, pidxs):
+        pidxs = list(pidxs)
+        if len(pidxs) == 0:
+            return
+        self.confidences[pidxs] = self.compute_confidences(pidxs, self.oidxs)
+        for pidx in pidxs:
+            self.confidence_versions[pidx] = self.predicate_versions[pidx]
+
+    # Runs the classifiers for several predicates on several objects.
+    # Returns a numpy array of shape (len(pidxs), len(oidxs), 2) of pos_conf, neg_conf entries; features for every
+    # object are stacked per context so each trained predicate's classifier is run once per context rather than
+    # once per object. Labeled objects get the Laplace-1 smoothed class balance of their labels instead.
+    def compute_confidences(self, pidxs, oidxs):
+        debug = False
+
+        confs = np.zeros((len(pidxs), len(oidxs), 2))
+        to_run = []  # row idxs of trained predicates whose classifiers need to be run
+        for idx in range(len(pidxs)):
+            if self.classifiers[pidxs[idx]] is not None:
+                to_run.append(idx)
+            else:
+                confs[idx, :, :] = 0.5  # confidences are equally uncertain
+
+        # Compiled linear predicates are run together as one product of the stacked observations with their
+        # weight matrix rows; any others fall back to their classifiers' predict.
+        to_run_linear = [idx for idx in to_run if self.linear_pidxs[pidxs[idx]]]
+        to_run = [idx for idx in to_run if not self.linear_pidxs[pidxs[idx]]]
+        if len(to_run) + len(to_run_linear) > 0:
+            linear_rows = [pidxs[idx] for idx in to_run_linear]
+            for b, m in self.contexts:
+                x, owners = get_observations_for_objects(b, m, oidxs, self.features)
+                if len(x) == 0:
+                    continue
+                owners = np.asarray(owners)
+                num_obs = np.bincount(owners, minlength=len(oidxs)).astype(float)
+                num_obs[num_obs == 0] = 1  # objects without observations in this context get no votes
+                if len(to_run_linear) > 0:
+                    z = (np.asarray(x, dtype=float).dot(self.linear_weights[b][m][linear_rows].T) +
+                         self.linear_biases[b][m][linear_rows]) > 0
+                    member = np.zeros((len(oidxs), len(owners)))
+                    member[owners, np.arange(len(owners))] = 1
+                    pos_counts = member.dot(z)
+                    neg_counts = member.sum(axis=1)[:, np.newaxis] - pos_counts
+                    w = np.array([self.weights[pidx][b][m] for pidx in linear_rows])
+                    confs[to_run_linear, :, 0] += (w * pos_counts / num_obs[:, np.newaxis]).T
+                    confs[to_run_linear, :, 1] += (w * neg_counts / num_obs[:, np.newaxis]).T
+                for idx in to_run:
+                    pidx = pidxs[idx]
+                    z = np.asarray(self.classifiers[pidx][b][m].predict(x))
+                    w = self.weights[pidx][b][m]
+                    confs[idx, :, 0] += w * np.bincount(owners, weights=(z == 1), minlength=len(oidxs)) / num_obs
+                    confs[idx, :, 1] += w * np.bincount(owners, weights=(z == -1), minlength=len(oidxs)) / num_obs
+
+        for idx in range(len(pidxs)):
+            for jdx in range(len(oidxs)):
+                neg_count, pos_count = self.get_label_counts(pidxs[idx], oidxs[jdx])
+                if neg_count + pos_count > 0:
+                    confs[idx, jdx, 0] = (1 + pos_count) / float(neg_count + pos_count + 2)
+                    confs[idx, jdx, 1] = (1 + neg_count) / float(neg_count + pos_count + 2)
+
+        if debug:
+            print("compute_confidences: returning confidences " + str(confs))
+        return confs
 
     # Updates the in-memory classifiers given new labels in the request.
     # Takes new_preds which will extend existing list, pidxs a list of predicate idxs,
@@ -159,7 +292,15 @@ class PerceptionClassifiers:
             print ("updating classifiers with new preds " + str(upreds) + " and triples " +
                    str([(upidxs[idx], uoidxs[idx], ulabels[idx]) for idx in range(len(upidxs))]))
         self.predicates.extend(upreds)
+        self.confidences = np.concatenate([self.confidences, np.full((len(upreds), len(self.oidxs), 2), 0.5)])
+        for b, m in self.contexts:
+            self.linear_weights[b][m] = np.concatenate([self.linear_weights[b][m],
+                                                        np.zeros((len(upreds), self.linear_weights[b][m].shape[1]))])
+            self.linear_biases[b][m] = np.concatenate([self.linear_biases[b][m], np.zeros(len(upreds))])
+        self.linear_pidxs = np.concatenate([self.linear_pidxs, np.zeros(len(upreds), dtype=bool)])
         for _ in range(len(upreds)):
+            self.predicate_versions.append(0)
+            self.confidence_versions.append(0)
             self.classifiers.append(None)
             self.kappas.append({b: {m: 0 for _b, m in self.contexts if b == _b}
                                 for b in self.behaviors})
@@ -170,20 +311,221 @@ class PerceptionClassifiers:
             if pidx not in retrain_pidxs:
                 retrain_pidxs.append(pidx)
             self.labels.append((pidx, uoidxs[idx], ulabels[idx]))
+            self.tally_label(pidx, uoidxs[idx], ulabels[idx])
+
+        # In online mode, fold the new labels into already-trained linear classifiers and defer their full refit;
+        # kappas and context weights keep their last fully-trained values until then. Predicates without a
+        # trained linear classifier to start from are still fully trained right away.
+        if self.online_updates:
+            online_pidxs = [pidx for pidx in retrain_pidxs if self.can_update_online(pidx)]
+            for pidx in online_pidxs:
+                pairs = [(uoidxs[idx], 1 if ulabels[idx] else -1) for idx in range(len(upidxs))
+                         if upidxs[idx] == pidx and uoidxs[idx] not in self.active_test_set]
+                self.update_online(pidx, pairs)
+                if pidx not in self.pending_retrain_pidxs:
+                    self.pending_retrain_pidxs.append(pidx)
+            if debug:
+                print("... updated online " + str(online_pidxs) + "; pending full refits " +
+                      str(self.pending_retrain_pidxs))
+            self.compile_classifiers(online_pidxs)
+            self.invalidate_confidences(online_pidxs)
+            self.refresh_confidences(online_pidxs)
+            retrain_pidxs = [pidx for pidx in retrain_pidxs if pidx not in online_pidxs]
         self.train_classifiers(retrain_pidxs)
 
+    # Whether the classifiers for a predicate are trained linear models new labels can be folded into.
+    def can_update_online(self, pidx):
+        if self.classifiers[pidx] is None:
+            return False
+        for b, m in self.contexts:
+            if get_linear_params(self.classifiers[pidx][b][m]) is None:
+                return False
+        return True
+
+    # Fold (oidx, label) pairs into each context classifier of a predicate with an online linear update.
+    def update_online(self, pidx, pairs):
+        for b, m in self.contexts:
+            c = self.classifiers[pidx][b][m]
+            if not isinstance(c, OnlineLinearClassifier):
+                c = OnlineLinearClassifier(*get_linear_params(c))
+                self.classifiers[pidx][b][m] = c
+            x, y = get_data_for_classifier(b, m, pairs, self.features)
+            c.update(x, y)
+
+    # Fully refit any predicates whose classifiers were updated online since their last full training.
+    def flush_pending_retrains(self):
+        if len(self.pending_retrain_pidxs) > 0:
+            self.train_classifiers(self.pending_retrain_pidxs[:])
+
     # Commits the trained classifiers and current labels to the classifier and source directories, respectively.
     def commit_changes(self):
         debug = False
 
         if debug:
             print("committing new predicates, labels, and classifiers to disk")
+        self.flush_pending_retrains()
         with open(os.path.join(self.source_dir, "predicates.pickle"), 'wb') as f:
             pickle.dump(self.predicates, f)
         with open(os.path.join(self.source_dir, "labels.pickle"), 'wb') as f:
             pickle.dump(self.labels, f)
-        with open(os.path.join(self.source_dir, self.classifiers_fn), 'wb') as f:
-            pickle.dump([self.classifiers, self.kappas], f)
+        for pidx in range(len(self.predicates)):
+            self.save_cached_classifier(pidx)
+        self.prune_classifier_cache()
+
+    # Copies the weights and biases of the given predicates' classifiers into the per-context linear weight
+    # matrices, marking which predicates have (only) linear context classifiers and so can be run compiled.
+    def compile_classifiers(self, pidxs):
+        for pidx in pidxs:
+            self.linear_pidxs[pidx] = False
+            if self.classifiers[pidx] is None:
+                continue
+            params = {}
+            for b, m in self.contexts:
+                params[(b, m)] = get_linear_params(self.classifiers[pidx][b][m])
+            if None in params.values():
+                continue
+            for b, m in self.contexts:
+                self.linear_weights[b][m][pidx], self.linear_biases[b][m][pidx] = params[(b, m)]
+            self.linear_pidxs[pidx] = True
+
+    # Returns the classifier cache key of a predicate, a hash of its training pairs and everything else that
+    # determines its fitted classifiers and kappas, or None if it lacks a +/- pair to fit.
+    def get_classifier_cache_key(self, pidx):
+        pairs = sorted(self.get_pairs_from_labels(pidx))
+        if -1 not in [l for _, l in pairs] or 1 not in [l for _, l in pairs]:
+            return None
+        inputs = [pairs, self.classifier_backend, self.kernel, self.kappa_mode,
+                  [(self.contexts[idx], self.context_fingerprints[idx]) for idx in range(len(self.contexts))]]
+        return hashlib.sha1(repr(inputs).encode('utf-8')).hexdigest()
+
+    # Reads the classifiers and kappas of a predicate from the cache. Returns True if the predicate needs no
+    # training, i.e. its entry was found or it has nothing to fit, and False otherwise.
+    def load_cached_classifier(self, pidx):
+        key = self.get_classifier_cache_key(pidx)
+        if key is None:
+            return True
+        compiled_fn = os.path.join(self.cache_dir, key + ".npz")
+        pickle_fn = os.path.join(self.cache_dir, key + ".pickle")
+        if os.path.isfile(compiled_fn):
+            with np.load(compiled_fn) as arrays:
+                self.classifiers[pidx] = {b: {} for b, _ in self.contexts}
+                self.kappas[pidx] = {b: {m: 0 for _b, m in self.contexts if b == _b} for b in self.behaviors}
+                for idx in range(len(self.contexts)):
+                    b, m = self.contexts[idx]
+                    self.classifiers[pidx][b][m] = LinearClassifier(arrays['weights_' + str(idx)],
+                                                                    arrays['biases'][idx])
+                    self.kappas[pidx][b][m] = float(arrays['kappas'][idx])
+        elif os.path.isfile(pickle_fn):
+            with open(pickle_fn, 'rb') as f:
+                self.classifiers[pidx], self.kappas[pidx] = pickle.load(f)
+        else:
+            return False
+        os.utime(compiled_fn if os.path.isfile(compiled_fn) else pickle_fn, None)  # mark entry used for pruning
+        self.compile_classifiers([pidx])
+        return True
+
+    # Classifiers used to be cached all together in a classifiers_<active test set> pickle, or a compiled .npz of
+    # the same name, in the source directory. Moves the given predicates' classifiers from such a legacy cache,
+    # if there is one, into the per-predicate cache, and renames the legacy files so this happens only once.
+    # Returns the predicates that still need training.
+    def migrate_legacy_classifiers(self, pidxs, debug=False):
+        base_fn = os.path.join(self.source_dir,
+                               "classifiers_" + '_'.join([str(oidx) for oidx in self.active_test_set]))
+        legacy_fns = [fn for fn in [base_fn + ".npz", base_fn + ".pickle"] if os.path.isfile(fn)]
+        if len(legacy_fns) == 0:
+            return pidxs
+
+        classifiers = None
+        kappas = None
+        if self.kernel == 'linear' and os.path.isfile(base_fn + ".npz"):
+            with np.load(base_fn + ".npz") as arrays:
+                if (len(arrays['trained']) == len(self.predicates) and
+                        list(zip(arrays['behaviors'], arrays['modalities'])) == self.contexts):
+                    classifiers = []
+                    kappas = []
+                    for pidx in range(len(self.predicates)):
+                        if arrays['trained'][pidx]:
+                            classifiers.append({b: {m: LinearClassifier(arrays['weights_' + str(idx)][pidx],
+                                                                        arrays['biases_' + str(idx)][pidx])
+                                                    for idx, (_b, m) in enumerate(self.contexts) if b == _b}
+                                                for b in self.behaviors})
+                        else:
+                            classifiers.append(None)
+                        kappas.append({b: {m: float(arrays['kappas'][pidx, idx])
+                                           for idx, (_b, m) in enumerate(self.contexts) if b == _b}
+                                       for b in self.behaviors})
+        if classifiers is None and os.path.isfile(base_fn + ".pickle"):
+            with open(base_fn + ".pickle", 'rb') as f:
+                classifiers, kappas = pickle.load(f)
+            if len(classifiers) != len(self.predicates):
+                classifiers = None
+
+        retrain_pidxs = []
+        for pidx in pidxs:
+            if classifiers is not None and classifiers[pidx] is not None:
+                self.classifiers[pidx] = classifiers[pidx]
+                self.kappas[pidx] = kappas[pidx]
+                self.compile_classifiers([pidx])
+                self.save_cached_classifier(pidx)
+            else:
+                retrain_pidxs.append(pidx)
+        for fn in legacy_fns:
+            os.rename(fn, fn + ".migrated")
+        if debug:
+            print("migrated " + str(len(pidxs) - len(retrain_pidxs)) + " predicates' classifiers from legacy " +
+                  "cache " + ', '.join(legacy_fns))
+        return retrain_pidxs
+
+    # Removes classifier cache entries that no current predicate uses and that no agent has loaded or written in
+    # the last cache_max_age_days days. Entries are shared by agents with other active test sets, so recently used
+    # ones are kept even if this agent does not reference them.
+    def prune_classifier_cache(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        keys = set([self.get_classifier_cache_key(pidx) for pidx in range(len(self.predicates))])
+        oldest = time.time() - self.cache_max_age_days * 24 * 60 * 60
+        for fn in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, fn)
+            if fn.split('.')[0] in keys or not os.path.isfile(path):
+                continue
+            try:
+                if os.path.getmtime(path) < oldest:
+                    os.remove(path)
+            except OSError:  # another agent process removed or replaced it first
+                pass
+
+    # Writes the classifiers and kappas of a trained predicate to the cache if they are not there already.
+    # Linear classifiers are stored compiled as arrays, which load much faster than an unpickled SVC per context.
+    def save_cached_classifier(self, pidx):
+        key = self.get_classifier_cache_key(pidx)
+        if key is None or self.classifiers[pidx] is None:
+            return
+        if self.linear_pidxs[pidx]:
+            fn = os.path.join(self.cache_dir, key + ".npz")
+        else:
+            fn = os.path.join(self.cache_dir, key + ".pickle")
+        if os.path.isfile(fn):
+            os.utime(fn, None)  # mark entry used for pruning
+            return
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:  # another agent process made it first
+                pass
+
+        # Write to a temporary file and move it into place so concurrent agents never read a partial entry.
+        tmp_fn = fn + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_fn, 'wb') as f:
+            if self.linear_pidxs[pidx]:
+                arrays = {'biases': np.array([self.linear_biases[b][m][pidx] for b, m in self.contexts]),
+                          'kappas': np.array([self.kappas[pidx][b][m] for b, m in self.contexts])}
+                for idx in range(len(self.contexts)):
+                    b, m = self.contexts[idx]
+                    arrays['weights_' + str(idx)] = self.linear_weights[b][m][pidx]
+                np.savez(f, **arrays)
+            else:
+                pickle.dump([self.classifiers[pidx], self.kappas[pidx]], f)
+        os.rename(tmp_fn, fn)
 
     # Get oidx, l from pidx, oidx, l labels.
     # Labels for each (pidx, oidx) are tallied and a majority vote is used to determine the object label.
@@ -194,14 +536,9 @@ class PerceptionClassifiers:
             print("get_pairs_from_labels: called for pred '" + self.predicates[pidx] + "'")
 
         pairs = []
-        oidx_votes = {}
-        for pjdx, oidx, l in self.labels:
-            if pjdx == pidx and oidx not in self.active_test_set:
-                if oidx not in oidx_votes:
-                    oidx_votes[oidx] = []
-                oidx_votes[oidx].append(1 if l else -1)
+        oidx_votes = self.label_counts[pidx] if pidx in self.label_counts else {}
         for oidx in oidx_votes:
-            s = sum(oidx_votes[oidx])
+            s = oidx_votes[oidx][1] - oidx_votes[oidx][0]
             if debug:
                 print("get_pairs_from_labels: ... oidx " + str(oidx) + " vote sum " + str(s))
             if s > 0:
@@ -216,20 +553,30 @@ class PerceptionClassifiers:
 
         if debug:
             print("training classifiers " + ','.join([self.predicates[pidx] for pidx in pidxs]))
+        pidxs = list(pidxs)
+        self.pending_retrain_pidxs = [pidx for pidx in self.pending_retrain_pidxs if pidx not in pidxs]
+
+        # Gather the (behavior, modality) fits needed for each predicate with both positive and negative pairs.
+        fit_pairs = {}
+        tasks = []
         for pidx in pidxs:
             train_pairs = self.get_pairs_from_labels(pidx)
             if -1 in [l for _, l in train_pairs] and 1 in [l for _, l in train_pairs]:
                 if debug:
                     print("... '" + self.predicates[pidx] + "' fitting with pairs " + str(train_pairs))
+                fit_pairs[pidx] = train_pairs
+                tasks.extend([(b, m, train_pairs) for b, m in self.contexts])
+        results = iter(self.fit_contexts(tasks))
+
+        for pidx in pidxs:
+            if pidx in fit_pairs:
                 pc = {}
                 pk = {}
                 for b, m in self.contexts:
                     if b not in pc:
                         pc[b] = {}
                         pk[b] = {}
-                    pc[b][m] = fit_classifier(b, m, train_pairs, self.features, self.kernel)
-                    pk[b][m] = get_margin_kappa(pc[b][m], b, m, train_pairs, self.features,
-                                                self.kernel, xval=train_pairs)
+                    pc[b][m], pk[b][m] = next(results)
                 s = sum([pk[b][m] for b, m in self.contexts])
                 for b, m in self.contexts:
                     pk[b][m] = pk[b][m] / float(s) if s > 0 else 1.0 / len(self.contexts)
@@ -250,11 +597,128 @@ class PerceptionClassifiers:
                                      for b in self.behaviors}
                 self.weights[pidx] = self.get_weight_from_kappa(pidx)
 
+        # Only the compiled weights and confidence rows of the predicates just trained need to be recomputed.
+        self.compile_classifiers(pidxs)
+        self.invalidate_confidences(pidxs)
+        self.refresh_confidences(pidxs)
+
+    # Given a list of (behavior, modality, pairs) fits, returns a parallel list of (classifier, kappa) results.
+    # If training_workers is more than one, the fits are spread across a pool of that many processes; each fit is
+    # independent and deterministic, so the results are the same as fitting them one after another.
+    def fit_contexts(self, tasks):
+        if self.training_workers > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(processes=min(self.training_workers, len(tasks)),
+                                        initializer=init_training_worker,
+                                        initargs=(self.features, self.kernel, self.kappa_mode, self.classifier_backend))
+            try:
+                results = pool.map(fit_context_in_worker, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [fit_context(b, m, pairs, self.features, self.kernel, self.kappa_mode, self.classifier_backend)
+                       for b, m, pairs in tasks]
+        return results
+
+
+# A fitted linear classifier reduced to its weights and bias, predicting -1/1 like the SVC it came from.
+class LinearClassifier:
+
+    def __init__(self, coef, intercept):
+        self.coef = np.array(coef, dtype=float)  # 1-D weight vector
+        self.intercept = float(intercept)  # float bias
+
+    def decision_function(self, x):
+        return np.asarray(x, dtype=float).dot(self.coef) + self.intercept
+
+    def predict(self, x):
+        return np.where(self.decision_function(x) > 0, 1, -1)
+
+
+# A linear classifier that new labeled observations can be folded into one at a time.
+# Starts from the weights of a fitted linear model and applies passive-aggressive (PA-I) updates, the online
+# counterpart of the hinge loss a linear SVM minimizes: each observation the classifier gets wrong or classifies
+# within the margin moves the hyperplane just far enough to fix it, with step size capped by c.
+class OnlineLinearClassifier(LinearClassifier):
+
+    def __init__(self, coef, intercept, c=1.0):
+        LinearClassifier.__init__(self, coef, intercept)
+        self.c = c  # float; aggressiveness cap on each update step
+
+    # Given observation rows x and parallel -1/1 labels y, update the weights one observation at a time.
+    def update(self, x, y):
+        for idx in range(len(y)):
+            obs = np.asarray(x[idx], dtype=float)
+            loss = max(0., 1. - y[idx] * (obs.dot(self.coef) + self.intercept))
+            if loss > 0:
+                tau = min(self.c, loss / (obs.dot(obs) + 1.))  # the bias acts as a constant extra feature
+                self.coef += tau * y[idx] * obs
+                self.intercept += tau * y[idx]
+
+
+# Classifier backends fit_classifier can use, by name. Each takes the kernel and returns an unfit classifier with
+# sklearn's fit and predict for -1/1 labels. Only 'svc' uses the kernel; the linear models ('linear_svm',
+# 'logistic') compile into the per-context weight matrices and can be updated online, while 'centroid' is the
+# cheapest to fit and is always run through its predict.
+classifier_backends = {'svc': lambda kernel: SVC(kernel=kernel, degree=2),
+                       'linear_svm': lambda kernel: LinearSVC(random_state=0),
+                       'logistic': lambda kernel: LogisticRegression(),
+                       'centroid': lambda kernel: NearestCentroid()}
+
+
+# Given a fitted classifier, returns its (1-D weight vector, float bias) if it is linear, and None otherwise.
+# The sign of the decision value matches predict, with positive values predicting 1.
+def get_linear_params(c):
+    if isinstance(c, LinearClassifier):
+        return c.coef, c.intercept
+    if hasattr(c, 'coef_') and hasattr(c, 'intercept_'):
+        return np.asarray(c.coef_, dtype=float).ravel(), float(np.asarray(c.intercept_).ravel()[0])
+    return None
+
+
+# Object features, kernel, kappa mode, and backend held by each training worker process, set once when the worker
+# starts.
+training_worker_features = None
+training_worker_kernel = None
+training_worker_kappa_mode = None
+training_worker_backend = None
+
+
+# Pool initializer for training workers.
+def init_training_worker(object_feats, kernel, kappa_mode, backend):
+    global training_worker_features, training_worker_kernel, training_worker_kappa_mode, training_worker_backend
+    training_worker_features = object_feats
+    training_worker_kernel = kernel
+    training_worker_kappa_mode = kappa_mode
+    training_worker_backend = backend
+
+
+# Pool task for training workers; takes a (behavior, modality, pairs) tuple.
+def fit_context_in_worker(task):
+    behavior, modality, pairs = task
+    return fit_context(behavior, modality, pairs, training_worker_features, training_worker_kernel,
+                       training_worker_kappa_mode, training_worker_backend)
+
+
+# Fits the classifier for a single context given training pairs and returns it alongside its
+# leave-one-object-out margin kappa.
+def fit_context(behavior, modality, pairs, object_feats, kernel, kappa_mode='exact', backend='svc'):
+    c = fit_classifier(behavior, modality, pairs, object_feats, kernel, backend)
+    k = get_margin_kappa(c, behavior, modality, pairs, object_feats, kernel, xval=pairs, kappa_mode=kappa_mode,
+                         backend=backend)
+    return c, k
+
 
 # Given an SVM c and its training data, calculate the agreement with gold labels according to kappa
 # agreement statistic at the observation level.
-def get_margin_kappa(c, behavior, modality, pairs, object_feats, kernel, xval=None):
-    x, y, z = get_classifier_results(c, behavior, modality, pairs, object_feats, kernel, xval)
+# kappa_mode 'exact' refits a classifier for every held-out object during cross validation, while 'support'
+# only refits when the held-out object contributed support vectors to c (see get_support_shortcut_results).
+def get_margin_kappa(c, behavior, modality, pairs, object_feats, kernel, xval=None, kappa_mode='exact',
+                     backend='svc'):
+    if kappa_mode == 'support' and xval is not None:
+        x, y, z = get_support_shortcut_results(c, behavior, modality, pairs, object_feats, kernel, xval, backend)
+    else:
+        x, y, z = get_classifier_results(c, behavior, modality, pairs, object_feats, kernel, xval, backend)
     cm = [[0, 0], [0, 0]]
     for idx in range(len(x)):
         cm[1 if y[idx] == 1 else 0][1 if z[idx] == 1 else 0] += 1
@@ -263,7 +727,7 @@ def get_margin_kappa(c, behavior, modality, pairs, object_feats, kernel, xval=No
 
 # Given an SVM and its training data, fit that training data, optionally retraining leaving
 # one object out at a time.
-def get_classifier_results(c, behavior, modality, pairs, object_feats, kernel, xval):
+def get_classifier_results(c, behavior, modality, pairs, object_feats, kernel, xval, backend='svc'):
     debug = False
     if debug:
         print ("get_classifier_results: called on " + str(type(c)) + ", " + behavior + ", " + modality + " with " +
@@ -295,7 +759,7 @@ def get_classifier_results(c, behavior, modality, pairs, object_feats, kernel, x
                     xval_pairs = [(ojdx, l) for (ojdx, l) in xval if ojdx != oidx]
                     ls = list(set([l for ojdx, l in xval_pairs]))
                     if len(ls) == 2:
-                        xval_c = fit_classifier(behavior, modality, xval_pairs, object_feats, kernel)
+                        xval_c = fit_classifier(behavior, modality, xval_pairs, object_feats, kernel, backend)
                     else:
                         xval_c = None
 
@@ -319,29 +783,77 @@ def get_classifier_results(c, behavior, modality, pairs, object_feats, kernel, x
     return x, y, z
 
 
-# Fits a new SVM classifier given a kernel, context, training pairs, and object feature structure.
-def fit_classifier(behavior, modality, pairs, object_feats, kernel):
+# Leave-one-object-out results like get_classifier_results with xval, but skipping refits that cannot change
+# the answer. An SVM's solution depends only on its support vectors, so removing an object none of whose
+# observations are support vectors of c leaves the refit classifier equal to c (up to solver tolerance), and
+# c's own predictions on that object are used instead. Falls back to get_classifier_results when c was not fit
+# on exactly the xval pairs or does not expose its support vectors.
+def get_support_shortcut_results(c, behavior, modality, pairs, object_feats, kernel, xval, backend='svc'):
+    if c is None or not hasattr(c, 'support_') or pairs != xval:
+        return get_classifier_results(c, behavior, modality, pairs, object_feats, kernel, xval, backend)
+
+    # Find the objects owning support vectors, walking the rows in the order fit_classifier stacked them.
+    support_rows = set(c.support_)
+    support_oidxs = set()
+    row = 0
+    for oidx, _ in xval:
+        if object_feats.has_context(oidx, behavior, modality):
+            start, end = object_feats.offsets[behavior][modality][oidx]
+            if len(support_rows.intersection(range(row, row + end - start))) > 0:
+                support_oidxs.add(oidx)
+            row += end - start
+
+    x = []
+    y = []
+    z = []
+    rel_oidxs = list(set([oidx for (oidx, l) in pairs]))
+    if len(rel_oidxs) > 1:
+        for oidx in rel_oidxs:
+            xval_pairs = [(ojdx, l) for (ojdx, l) in xval if ojdx != oidx]
+            ls = list(set([l for ojdx, l in xval_pairs]))
+            if len(ls) == 2:
+                if oidx in support_oidxs:
+                    xval_c = fit_classifier(behavior, modality, xval_pairs, object_feats, kernel, backend)
+                else:
+                    xval_c = c
+            else:
+                xval_c = None
+
+            xval_pairs = [(ojdx, l) for (ojdx, l) in pairs if ojdx == oidx]
+            _x, _y = get_data_for_classifier(behavior, modality, xval_pairs, object_feats)
+            if xval_c is not None:
+                _z = xval_c.predict(_x)
+            else:  # If insufficient data, vote the same label as the training data.
+                _z = [1 if len(ls) > 0 and ls[0] == 1 else -1 for _ in range(len(_x))]
+            x.extend(_x)
+            y.extend(_y)
+            z.extend(_z)
+    else:
+        x, y = get_data_for_classifier(behavior, modality, pairs, object_feats)
+        z = [-1 for _ in range(len(x))]  # Single object, so guess majority class no.
+    return x, y, z
+
+
+# Fits a new classifier given a kernel, context, training pairs, object feature store, and classifier backend.
+def fit_classifier(behavior, modality, pairs, object_feats, kernel, backend='svc'):
     x, y = get_data_for_classifier(behavior, modality, pairs, object_feats)
     assert len(x) > 0  # there is data
     assert min(y) < max(y)  # there is more than one label
-    c = SVC(kernel=kernel, degree=2)
+    c = classifier_backends[backend](kernel)
     c.fit(x, y)
     return c
 
 
-# Given a context, label pairs, and object feature structure, returns SVM-friendly x, y training vectors.
+# Given a context, label pairs, and object feature store, returns SVM-friendly x, y training vectors.
+# x is a 2-D array sliced from the store's contiguous context array rather than a rebuilt list of lists.
 def get_data_for_classifier(behavior, modality, pairs, object_feats):
-    x = []
-    y = []
-    for oidx, label in pairs:
-        if behavior in object_feats[oidx] and modality in object_feats[oidx][behavior]:
-            for obs in object_feats[oidx][behavior][modality]:
-                if len(obs) == 1 and type(obs[0]) is list:  # un-nest single observation vectors
-                    obs = obs[0]
-                x.append(obs)
-                l = 1 if label == 1 else -1
-                y.append(l)
-    return x, y
+    return object_feats.get_data(behavior, modality, pairs)
+
+
+# Given a context, a list of object idxs, and object feature store, returns the observation vectors of
+# those objects in that context alongside, for each vector, the position in oidxs of the object it came from.
+def get_observations_for_objects(behavior, modality, oidxs, object_feats):
+    return object_feats.get_observations(behavior, modality, oidxs)
 
 
 # Returns non-negative kappa.
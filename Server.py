@@ -18,7 +18,7 @@ class Server:
 
     def __init__(self, active_train_set, grounder_fn, spin_time, cycles_per_user,
                  client_dir, log_dir, data_dir,
-                 num_dialogs, init_phase):
+                 num_dialogs, init_phase, parses_to_ground=1, grounding_workers=1):
         self.active_train_set = active_train_set
         self.grounder_fn = grounder_fn
         self.spin_time = spin_time
@@ -28,6 +28,8 @@ class Server:
         self.data_dir = data_dir
         self.num_dialogs = num_dialogs
         self.init_phase = init_phase
+        self.parses_to_ground = parses_to_ground
+        self.grounding_workers = grounding_workers
 
         # State and message information.
         self.users = []  # uids
@@ -66,7 +68,9 @@ class Server:
                                            "--data_dir", self.data_dir,
                                            "--spin_time", str(self.spin_time),
                                            "--num_dialogs", str(self.num_dialogs),
-                                           "--init_phase", str(self.init_phase)]
+                                           "--init_phase", str(self.init_phase),
+                                           "--parses_to_ground", str(self.parses_to_ground),
+                                           "--grounding_workers", str(self.grounding_workers)]
                                     if self.active_train_set is not None:
                                         cmd.extend(["--active_train_set", ','.join([str(oidx)
                                                                                    for oidx in self.active_train_set])])
@@ -153,9 +157,18 @@ def main():
     log_dir = FLAGS_log_dir
     data_dir = FLAGS_data_dir
     write_classifiers = FLAGS_write_classifiers
+    training_workers = FLAGS_training_workers
+    kappa_mode = FLAGS_kappa_mode
+    online_updates = FLAGS_online_updates
+    classifier_backend = FLAGS_classifier_backend
+    grounding_engine = FLAGS_grounding_engine
+    the_grounding = FLAGS_the_grounding
+    grounding_profile_fn = FLAGS_grounding_profile_fn
     load_grounder = FLAGS_load_grounder
     num_dialogs = FLAGS_num_dialogs
     init_phase = FLAGS_init_phase
+    parses_to_ground = FLAGS_parses_to_ground
+    grounding_workers = FLAGS_grounding_workers
 
     # Load the parser from file.
     print("main: loading parser from file...")
@@ -184,7 +197,10 @@ def main():
     if load_grounder != 1:
         print("main: instantiating grounder...")
         g = KBGrounder.KBGrounder(p, kb_static_facts_fn, kb_perception_source_dir, kb_perception_feature_dir,
-                                  active_test_set)
+                                  active_test_set, training_workers=training_workers,
+                                  kappa_mode=kappa_mode, online_updates=online_updates == 1,
+                                  classifier_backend=classifier_backend, engine=grounding_engine,
+                                  the_grounding=the_grounding, profile_fn=grounding_profile_fn)
         if write_classifiers:
             print("main: and writing grounder perception classifiers to file...")
             g.kb.pc.commit_changes()  # save classifiers to disk
@@ -197,7 +213,7 @@ def main():
     print("main: instantiated server...")
     s = Server(active_train_set, grounder_fn, server_spin_time, cycles_per_user,
                client_dir, log_dir, data_dir,
-               num_dialogs, init_phase)
+               num_dialogs, init_phase, parses_to_ground=parses_to_ground, grounding_workers=grounding_workers)
     print("main: ... done")
 
     print("main: spinning server...")
@@ -233,6 +249,25 @@ if __name__ == '__main__':
                         help="direcotry where we will write out information gathered during dialogs")
     parser.add_argument('--write_classifiers', type=int, required=False, default=0,
                         help="whether to write loaded/trained perception classifiers back to disk")
+    parser.add_argument('--training_workers', type=int, required=False, default=1,
+                        help="processes to spread perception classifier training across when not loaded from cache")
+    parser.add_argument('--kappa_mode', type=str, required=False, default='exact',
+                        help="'exact' or 'support' leave-one-object-out kappa estimation during classifier training")
+    parser.add_argument('--online_updates', type=int, required=False, default=0,
+                        help="if 1, fold perception labels from dialogs into classifiers online and refit later")
+    parser.add_argument('--classifier_backend', type=str, required=False, default='svc',
+                        help="one of 'svc', 'linear_svm', 'logistic', or 'centroid' perception classifiers")
+    parser.add_argument('--grounding_engine', type=str, required=False, default='recursive',
+                        help="'recursive' or 'vectorized' grounding of lambda assignments")
+    parser.add_argument('--the_grounding', type=str, required=False, default='unique',
+                        help="'unique' to ground 'the' to the only assignment making its argument True, or " +
+                             "'singleton' to require its argument to have exactly one grounding")
+    parser.add_argument('--grounding_profile_fn', type=str, required=False,
+                        help="a file to append JSON profiles of every grounding to; if not provided, none are kept")
+    parser.add_argument('--parses_to_ground', type=int, required=False, default=1,
+                        help="how many of the parser's best parses of each utterance agents ground")
+    parser.add_argument('--grounding_workers', type=int, required=False, default=1,
+                        help="processes each agent grounds those parses concurrently across")
     parser.add_argument('--load_grounder', type=int, required=False, default=0,
                         help="whether to load the grounder from disk (for testing purposes)")
     parser.add_argument('--num_dialogs', type=int, required=False, default=1,
@@ -35,6 +35,13 @@ def main():
         kb_perception_feature_dir = FLAGS_kb_perception_feature_dir
         active_test_set = [int(oidx) for oidx in FLAGS_active_test_set.split(',')]
     write_classifiers = FLAGS_write_classifiers
+    training_workers = FLAGS_training_workers
+    kappa_mode = FLAGS_kappa_mode
+    online_updates = FLAGS_online_updates
+    classifier_backend = FLAGS_classifier_backend
+    grounding_engine = FLAGS_grounding_engine
+    the_grounding = FLAGS_the_grounding
+    grounding_profile_fn = FLAGS_grounding_profile_fn
     uid = FLAGS_uid
     data_dir = FLAGS_data_dir
     client_dir = FLAGS_client_dir
@@ -43,6 +50,8 @@ def main():
     init_phase = FLAGS_init_phase
     max_syn_qs = FLAGS_max_syn_qs
     max_opp_qs = FLAGS_max_opp_qs
+    parses_to_ground = FLAGS_parses_to_ground
+    grounding_workers = FLAGS_grounding_workers
     image_path = FLAGS_image_path
     no_clarify = FLAGS_no_clarify.split(',') if FLAGS_no_clarify is not None else None
     assert io_type == 'keyboard' or io_type == 'server' or io_type == 'robot'
@@ -77,7 +86,10 @@ def main():
         # Instantiate a grounder.
         print("main: instantiating grounder...")
         g = KBGrounder.KBGrounder(p, kb_static_facts_fn, kb_perception_source_dir, kb_perception_feature_dir,
-                                  active_test_set)
+                                  active_test_set, training_workers=training_workers,
+                                  kappa_mode=kappa_mode, online_updates=online_updates == 1,
+                                  classifier_backend=classifier_backend, engine=grounding_engine,
+                                  the_grounding=the_grounding, profile_fn=grounding_profile_fn)
         if write_classifiers:
             print("main: and writing grounder perception classifiers to file...")
             g.kb.pc.commit_changes()  # save classifiers to disk
@@ -120,7 +132,8 @@ def main():
         a = Agent.Agent(p, g, io, active_train_set, no_clarify=no_clarify,
                         use_shorter_utterances=use_shorter_utterances,
                         word_neighbors_to_consider_as_synonyms=max_syn_qs,
-                        max_perception_subdialog_qs=max_opp_qs)
+                        max_perception_subdialog_qs=max_opp_qs,
+                        parses_to_ground=parses_to_ground, grounding_workers=grounding_workers)
         print("main: ... done")
 
         # Start a dialog.
@@ -173,6 +186,21 @@ if __name__ == '__main__':
                         help="one of 'keyboard' or 'server'")
     parser.add_argument('--write_classifiers', type=int, required=False, default=0,
                         help="whether to write loaded/trained perception classifiers back to disk")
+    parser.add_argument('--training_workers', type=int, required=False, default=1,
+                        help="processes to spread perception classifier training across when not loaded from cache")
+    parser.add_argument('--kappa_mode', type=str, required=False, default='exact',
+                        help="'exact' or 'support' leave-one-object-out kappa estimation during classifier training")
+    parser.add_argument('--online_updates', type=int, required=False, default=0,
+                        help="if 1, fold perception labels from dialogs into classifiers online and refit later")
+    parser.add_argument('--classifier_backend', type=str, required=False, default='svc',
+                        help="one of 'svc', 'linear_svm', 'logistic', or 'centroid' perception classifiers")
+    parser.add_argument('--grounding_engine', type=str, required=False, default='recursive',
+                        help="'recursive' or 'vectorized' grounding of lambda assignments")
+    parser.add_argument('--the_grounding', type=str, required=False, default='unique',
+                        help="'unique' to ground 'the' to the only assignment making its argument True, or " +
+                             "'singleton' to require its argument to have exactly one grounding")
+    parser.add_argument('--grounding_profile_fn', type=str, required=False,
+                        help="a file to append JSON profiles of every grounding to; if not provided, none are kept")
     parser.add_argument('--grounder_fn', type=str, required=False,
                         help="a grounder pickle to load; if not provided, a new one will be instantiated")
     parser.add_argument('--kb_static_facts_fn', type=str, required=False,
@@ -202,6 +230,10 @@ if __name__ == '__main__':
                         help="the maximum number of synonym neighbors to ask about")
     parser.add_argument('--max_opp_qs', type=int, required=False, default=3,
                         help="the maximum number of perception questions to ask")
+    parser.add_argument('--parses_to_ground', type=int, required=False, default=1,
+                        help="how many of the parser's best parses of each utterance to ground")
+    parser.add_argument('--grounding_workers', type=int, required=False, default=1,
+                        help="processes to ground those parses concurrently across")
     parser.add_argument('--image_path', type=str, required=False,
                         help="filepath to the directory where object images live")
     parser.add_argument('--no_clarify', type=str, required=False,
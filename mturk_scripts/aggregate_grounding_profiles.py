@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+__author__ = 'jesse'
+
+import argparse
+import json
+import os
+
+
+# Aggregates the JSON records KBGrounder writes to its profile_fn, e.g. those of every agent in a fold, reporting
+# time and node counts per kind of node grounded, per-call totals, and the slowest forms.
+def main():
+
+    # Load parameters from command line.
+    profile_fns = FLAGS_profile_fns.split(',')
+    num_slowest = FLAGS_num_slowest
+
+    records = []
+    for fn in profile_fns:
+        if not os.path.isfile(fn):
+            print("main: skipping missing profile '" + fn + "'")
+            continue
+        with open(fn, 'r') as f:
+            for line in f.readlines():
+                if len(line.strip()) > 0:
+                    records.append(json.loads(line))
+    if len(records) == 0:
+        print("no profile records found")
+        return
+    print("read " + str(len(records)) + " records, " + str(len([r for r in records if r['cached']])) +
+          " of them grounding cache hits, " + str(len([r for r in records if r['timed_out']])) + " timed out")
+
+    # Time and node counts per branch across every call.
+    branch_ms = {}
+    branch_nodes = {}
+    for r in records:
+        for branch in r['branch_ms']:
+            branch_ms[branch] = branch_ms.get(branch, 0.0) + r['branch_ms'][branch]
+            branch_nodes[branch] = branch_nodes.get(branch, 0) + r['branch_nodes'][branch]
+    total_ms = sum([r['ms'] for r in records])
+    print("BRANCH\tMS\tPERCENT\tNODES")
+    for branch in sorted(branch_ms, key=lambda b: branch_ms[b], reverse=True):
+        print(branch + "\t%.1f\t%.1f\t%d" % (branch_ms[branch], 100 * branch_ms[branch] / total_ms,
+                                            branch_nodes[branch]))
+
+    # Per-call means of the counters.
+    print("mean per call:")
+    for counter in ['ms', 'assignments', 'pruned', 'copies', 'queries', 'array_queries', 'groundings']:
+        values = [r[counter] for r in records if r.get(counter) is not None]
+        if len(values) > 0:
+            print("\t" + counter + "\t%.2f" % (sum(values) / float(len(values))))
+
+    # The slowest forms by their total time across calls.
+    form_ms = {}
+    form_calls = {}
+    for r in records:
+        form_ms[r['form']] = form_ms.get(r['form'], 0.0) + r['ms']
+        form_calls[r['form']] = form_calls.get(r['form'], 0) + 1
+    print("MS\tCALLS\tFORM")
+    for form in sorted(form_ms, key=lambda fm: form_ms[fm], reverse=True)[:num_slowest]:
+        print("%.1f\t%d\t%s" % (form_ms[form], form_calls[form], form))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile_fns', type=str, required=True,
+                        help="comma-separated grounding profile files written by KBGrounder")
+    parser.add_argument('--num_slowest', type=int, required=False, default=10,
+                        help="how many of the slowest forms to list")
+    args = parser.parse_args()
+    for k, v in vars(args).items():
+        globals()['FLAGS_%s' % k] = v
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+__author__ = 'jesse'
+
+import sys
+sys.path.append('../')  # necessary to import PerceptionClassifiers from above directory
+
+import argparse
+import numpy as np
+import PerceptionClassifiers
+import pickle
+import time
+
+
+# Compares perception classifier backends on the same labels and features (e.g., the ispy_setting perception
+# resources), reporting for each the time to fit every (predicate, context) classifier, the latency of running a
+# predicate's classifiers on one object, the pickled size of the fit classifiers, and their mean
+# leave-one-object-out kappa.
+def main():
+
+    # Load parameters from command line.
+    kb_perception_source_dir = FLAGS_kb_perception_source_dir
+    kb_perception_feature_dir = FLAGS_kb_perception_feature_dir
+    active_test_set = [int(oidx) for oidx in FLAGS_active_test_set.split(',')]
+    behaviors = FLAGS_behaviors.split(',') if FLAGS_behaviors is not None else None
+    modalities = FLAGS_modalities.split(',') if FLAGS_modalities is not None else None
+    backends = FLAGS_backends.split(',') if FLAGS_backends is not None else \
+        sorted(PerceptionClassifiers.classifier_backends.keys())
+
+    # Classifiers are fit directly below, so this instance only supplies labels, features, and contexts.
+    print("main: loading perception classifiers...")
+    pc = PerceptionClassifiers.PerceptionClassifiers(kb_perception_source_dir, kb_perception_feature_dir,
+                                                     active_test_set, behaviors=behaviors, modalities=modalities)
+    print("main: ... done")
+
+    fit_pairs = {}
+    for pidx in range(len(pc.predicates)):
+        pairs = pc.get_pairs_from_labels(pidx)
+        if -1 in [l for _, l in pairs] and 1 in [l for _, l in pairs]:
+            fit_pairs[pidx] = pairs
+    if len(fit_pairs) == 0:
+        print("no predicate has both positive and negative labels to fit")
+        return
+    query_oidxs = [oidx for oidx in pc.oidxs if oidx not in active_test_set]
+    print("fitting " + str(len(fit_pairs)) + " predicates in " + str(len(pc.contexts)) + " contexts; " +
+          "querying " + str(len(query_oidxs)) + " objects")
+
+    print("BACKEND\tFIT_S\tPREDICT_MS\tMODEL_KB\tKAPPA")
+    for backend in backends:
+        fit_time = 0
+        predict_time = 0
+        model_bytes = 0
+        kappas = []
+        for pidx in fit_pairs:
+            for b, m in pc.contexts:
+                t = time.time()
+                c = PerceptionClassifiers.fit_classifier(b, m, fit_pairs[pidx], pc.features, pc.kernel, backend)
+                fit_time += time.time() - t
+                model_bytes += len(pickle.dumps(c))
+                kappas.append(PerceptionClassifiers.get_margin_kappa(c, b, m, fit_pairs[pidx], pc.features,
+                                                                     pc.kernel, xval=fit_pairs[pidx],
+                                                                     backend=backend))
+                for oidx in query_oidxs:
+                    x, _ = PerceptionClassifiers.get_observations_for_objects(b, m, [oidx], pc.features)
+                    if len(x) > 0:
+                        t = time.time()
+                        c.predict(x)
+                        predict_time += time.time() - t
+        print(backend + "\t%.3f\t%.4f\t\t%.1f\t\t%.3f" %
+              (fit_time, 1000 * predict_time / (len(fit_pairs) * len(query_oidxs)), model_bytes / 1024.,
+               np.mean(kappas)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kb_perception_source_dir', type=str, required=True,
+                        help="perception source directory with predicates and labels")
+    parser.add_argument('--kb_perception_feature_dir', type=str, required=True,
+                        help="perception feature directory for knowledge base")
+    parser.add_argument('--active_test_set', type=str, required=True,
+                        help="objects excluded from perception classifier training")
+    parser.add_argument('--behaviors', type=str, required=False,
+                        help="specify behaviors to consider")
+    parser.add_argument('--modalities', type=str, required=False,
+                        help="specify modalities to consider")
+    parser.add_argument('--backends', type=str, required=False,
+                        help="comma-separated classifier backends to compare; defaults to all of them")
+    args = parser.parse_args()
+    for k, v in vars(args).items():
+        globals()['FLAGS_%s' % k] = v
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+__author__ = 'jesse'
+
+import sys
+sys.path.append('../')  # necessary to import KBGrounder from above directory
+sys.path.append('../../tsp/')  # necessary to import CKYParser
+
+import argparse
+import KBGrounder
+import pickle
+import time
+
+
+# Reads semantic forms from a file of either bare forms or utterance/'M : form' pairs like the parser's
+# init_train files, skipping blank lines and utterances.
+def read_forms(fn):
+    forms = []
+    with open(fn, 'r') as f:
+        lines = [l.strip() for l in f.readlines()]
+    paired = len([l for l in lines if l[:4] == 'M : ']) > 0
+    for l in lines:
+        if len(l) == 0 or l[0] == '#':
+            continue
+        if paired:
+            if l[:4] == 'M : ':
+                forms.append(l[4:])
+        else:
+            forms.append(l)
+    return forms
+
+
+# Times the grounder on representative parses, e.g. those in the parser's training files or logs, and the
+# KnowledgeBase queries behind it. Compares the grounder's engines against one another on the same parses; run
+# against two revisions of the grounder for a before/after comparison.
+def main():
+
+    # Load parameters from command line.
+    parser_fn = FLAGS_parser_fn
+    grounder_fn = FLAGS_grounder_fn
+    forms_fn = FLAGS_forms_fn
+    reps = FLAGS_reps
+
+    print("main: loading parser and grounder...")
+    with open(parser_fn, 'rb') as f:
+        p = pickle.load(f)
+    if grounder_fn is not None:
+        with open(grounder_fn, 'rb') as f:
+            g = pickle.load(f)
+        g.parser = p
+    else:
+        active_test_set = [int(oidx) for oidx in FLAGS_active_test_set.split(',')]
+        g = KBGrounder.KBGrounder(p, FLAGS_kb_static_facts_fn, FLAGS_kb_perception_source_dir,
+                                  FLAGS_kb_perception_feature_dir, active_test_set)
+    print("main: ... done")
+
+    forms = []
+    for s in read_forms(forms_fn):
+        try:
+            forms.append((s, p.lexicon.read_semantic_form_from_str(s, None, None, [])))
+        except (AssertionError, ValueError, KeyError, IndexError):
+            print("main: ... skipping unreadable form '" + s + "'")
+
+    # Ground each form reps times with each engine the grounder has, reporting the mean time per engine, how many
+    # groundings the first engine finds, whether every engine finds the same groundings, and the first engine's
+    # subtree memo statistics. Engines are timed with the cross-call grounding cache off, and then the time to
+    # answer the form from the cache is reported too, if the grounder has one.
+    engines = FLAGS_engines.split(',') if hasattr(g, 'engine') else [None]
+    cache_size = g.grounding_cache_size if hasattr(g, 'grounding_cache') else None
+    print("\t".join([(e.upper() + '_' if e is not None else '') + "MS" for e in engines]) +
+          ("\tCACHED_MS" if cache_size is not None else '') + "\tGROUNDINGS\tAGREE\tMEMO_HITS/MISSES\tPRUNED\tFORM")
+    totals = [0 for _ in range(len(engines) + (1 if cache_size is not None else 0))]
+    for s, form in forms:
+        ms = []
+        results = []
+        stats = None
+        if cache_size is not None:
+            g.grounding_cache_size = 0
+            g.reset_grounding_cache()
+        for engine in engines:
+            if engine is not None:
+                g.engine = engine
+            t = time.time()
+            groundings = None
+            for _ in range(reps):
+                groundings = g.ground_semantic_tree(form)
+            ms.append(1000 * (time.time() - t) / reps)
+            results.append([(str(gt) if type(gt) is bool else p.print_parse(gt), la, conf)
+                            for gt, la, conf in groundings] if groundings is not None else None)
+            if stats is None:
+                stats = getattr(g, 'last_grounding_memo_stats', None)
+        if cache_size is not None:
+            g.grounding_cache_size = cache_size
+            g.ground_semantic_tree(form)
+            t = time.time()
+            for _ in range(reps):
+                g.ground_semantic_tree(form)
+            ms.append(1000 * (time.time() - t) / reps)
+        for idx in range(len(ms)):
+            totals[idx] += ms[idx]
+        memo = str(stats['hits']) + '/' + str(stats['misses']) if stats is not None else '-'
+        pruned = str(stats.get('pruned', '-')) if stats is not None else '-'
+        print("\t".join(["%.2f" % m for m in ms]) + "\t%s\t\t%s\t%s\t\t%s\t%s" %
+              (str(len(results[0])) if results[0] is not None else '-',
+               str(False not in [r == results[0] for r in results]), memo, pruned, s))
+    if len(forms) > 0:
+        print("mean ms per form:\t" + "\t".join(["%.2f" % (total / len(forms)) for total in totals]) +
+              "\t(%d forms)" % len(forms))
+
+    # Compare name-str KB queries against the ontology idx queries the grounder issues, over every static fact
+    # and every perceptual predicate on every active test object.
+    kb = g.kb
+    queries = sorted([tuple([kb.ontology.preds[idx] for idx in f]) for f in kb.static_facts]) \
+        if hasattr(kb, 'query_idxs') else sorted(kb.static_facts)
+    queries.extend([(pred, 'oidx_' + str(oidx)) for pred in kb.perceptual_preds for oidx in g.active_test_set
+                    if pred in p.ontology.preds and 'oidx_' + str(oidx) in p.ontology.preds])
+    t = time.time()
+    for _ in range(reps):
+        for q in queries:
+            kb.query(q)
+    print("str query us:\t%.3f\t(%d queries)" % (1000000 * (time.time() - t) / (reps * len(queries)), len(queries)))
+    if hasattr(kb, 'query_idxs'):
+        idx_queries = [tuple([p.ontology.preds.index(a) for a in q]) for q in queries]
+        t = time.time()
+        for _ in range(reps):
+            for q in idx_queries:
+                kb.query_idxs(q)
+        print("idx query us:\t%.3f" % (1000000 * (time.time() - t) / (reps * len(queries))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parser_fn', type=str, required=True,
+                        help="a parser pickle to read semantic forms with")
+    parser.add_argument('--forms_fn', type=str, required=True,
+                        help="file of semantic forms to ground, bare or as utterance/'M : form' pairs")
+    parser.add_argument('--grounder_fn', type=str, required=False,
+                        help="a grounder pickle to load; if not provided, a new one will be instantiated")
+    parser.add_argument('--kb_static_facts_fn', type=str, required=False,
+                        help="static facts file for the knowledge base")
+    parser.add_argument('--kb_perception_source_dir', type=str, required=False,
+                        help="perception source directory for knowledge base")
+    parser.add_argument('--kb_perception_feature_dir', type=str, required=False,
+                        help="perception feature directory for knowledge base")
+    parser.add_argument('--active_test_set', type=str, required=False,
+                        help="objects to consider possibilities for grounding")
+    parser.add_argument('--engines', type=str, required=False, default='recursive,vectorized',
+                        help="comma-separated grounding engines to compare, if the grounder has more than one")
+    parser.add_argument('--reps', type=int, required=False, default=10,
+                        help="how many times to ground each form")
+    args = parser.parse_args()
+    for k, v in vars(args).items():
+        globals()['FLAGS_%s' % k] = v
+    main()
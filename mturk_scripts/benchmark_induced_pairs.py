@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+__author__ = 'jesse'
+
+import sys
+sys.path.append('../')  # necessary to import Agent from above directory
+sys.path.append('../../tsp/')  # necessary to unpickle the CKYParser
+
+import argparse
+import pickle
+import random
+import time
+
+
+# Measures the throughput, in pairs per second, of getting semantic forms for the induced utterance/grounding
+# pairs of an Agent pickle, e.g. the agent.temp.pickle train_new_grounder_from_agg_data writes after inducing
+# pairs from the aggregated training data. Compares sequential parsing and grounding against the pipeline that
+# grounds parses in a pool of workers while later parses are produced, and whether each finds the same pairs.
+def main():
+
+    # Load parameters from command line.
+    agent_fn = FLAGS_agent_fn
+    workers = [int(w) for w in FLAGS_grounding_workers.split(',')]
+    num_pairs = FLAGS_num_pairs
+
+    print("main: loading agent...")
+    with open(agent_fn, 'rb') as f:
+        a = pickle.load(f)
+    if num_pairs is not None:
+        a.induced_utterance_grounding_pairs = a.induced_utterance_grounding_pairs[:num_pairs]
+    print("main: ... done; " + str(len(a.induced_utterance_grounding_pairs)) + " induced pairs")
+    if len(a.induced_utterance_grounding_pairs) == 0:
+        return
+
+    print("WORKERS\tSECONDS\tPAIRS/S\tFOUND\tAGREE")
+    results = []
+    for w in workers:
+        a.grounding_workers = w
+        a.grounder.reset_grounding_cache()
+        random.seed(FLAGS_seed)  # ties among best interpolated parses are broken at random
+        t = time.time()
+        triples = a.get_semantic_forms_for_induced_pairs(FLAGS_parse_reranker_beam,
+                                                         FLAGS_interpolation_reranker_beam)
+        seconds = time.time() - t
+        results.append([(x, a.parser.print_parse(y, True), a.parser.print_parse(z, False)) for x, y, z in triples])
+        print(str(w) + "\t%.2f\t%.3f\t%d\t%s" % (seconds, len(a.induced_utterance_grounding_pairs) / seconds,
+                                                 len(triples), str(results[-1] == results[0])))
+        a.close_grounding_pool()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--agent_fn', type=str, required=True,
+                        help="an Agent pickle with induced utterance/grounding pairs")
+    parser.add_argument('--grounding_workers', type=str, required=False, default='1,4',
+                        help="comma-separated grounding worker counts to compare; 1 is sequential")
+    parser.add_argument('--num_pairs', type=int, required=False,
+                        help="only use the first this many induced pairs")
+    parser.add_argument('--parse_reranker_beam', type=int, required=False, default=1,
+                        help="parser reranker beam, as in train_new_grounder_from_agg_data")
+    parser.add_argument('--interpolation_reranker_beam', type=int, required=False, default=10,
+                        help="matching parses to find per pair, as in train_new_grounder_from_agg_data")
+    parser.add_argument('--seed', type=int, required=False, default=0,
+                        help="random seed for breaking ties among parses")
+    args = parser.parse_args()
+    for k, v in vars(args).items():
+        globals()['FLAGS_%s' % k] = v
+    main()
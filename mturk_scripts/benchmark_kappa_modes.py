@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+__author__ = 'jesse'
+
+import sys
+sys.path.append('../')  # necessary to import PerceptionClassifiers from above directory
+
+import argparse
+import PerceptionClassifiers
+import time
+
+
+# Compares the exact leave-one-object-out context kappas against the support vector shortcut, reporting the time
+# each takes to fit every (predicate, context) classifier with its kappa and how far the shortcut's kappas drift
+# from the exact ones.
+def main():
+
+    # Load parameters from command line.
+    kb_perception_source_dir = FLAGS_kb_perception_source_dir
+    kb_perception_feature_dir = FLAGS_kb_perception_feature_dir
+    active_test_set = [int(oidx) for oidx in FLAGS_active_test_set.split(',')]
+    behaviors = FLAGS_behaviors.split(',') if FLAGS_behaviors is not None else None
+    modalities = FLAGS_modalities.split(',') if FLAGS_modalities is not None else None
+    modes = ['exact', 'support']
+
+    print("main: loading perception classifiers...")
+    pc = PerceptionClassifiers.PerceptionClassifiers(kb_perception_source_dir, kb_perception_feature_dir,
+                                                     active_test_set, behaviors=behaviors, modalities=modalities)
+    print("main: ... done")
+
+    print("PRED:\t" + '\t'.join([mode.upper() + "_S" for mode in modes]) + "\tMAX_DIFF")
+    times = {mode: 0 for mode in modes}
+    diffs = []
+    for pidx in range(len(pc.predicates)):
+        pairs = pc.get_pairs_from_labels(pidx)
+        if -1 not in [l for _, l in pairs] or 1 not in [l for _, l in pairs]:
+            continue
+        pred_times = {mode: 0 for mode in modes}
+        pred_diffs = []
+        for b, m in pc.contexts:
+            ks = {}
+            for mode in modes:
+                t = time.time()
+                _, ks[mode] = PerceptionClassifiers.fit_context(b, m, pairs, pc.features, pc.kernel, mode)
+                pred_times[mode] += time.time() - t
+            pred_diffs.append(abs(ks['exact'] - ks['support']))
+        print(pc.predicates[pidx] + ":\t" + '\t'.join(['%.3f' % pred_times[mode] for mode in modes]) +
+              '\t%.4f' % max(pred_diffs))
+        for mode in modes:
+            times[mode] += pred_times[mode]
+        diffs.extend(pred_diffs)
+
+    if len(diffs) > 0:
+        print("total seconds:\t" + '\t'.join(['%.3f' % times[mode] for mode in modes]) +
+              "\t(speedup %.2fx)" % (times['exact'] / times['support'] if times['support'] > 0 else 0))
+        print("kappa abs diff:\tmean %.4f\tmax %.4f\t(%d of %d contexts differ)" %
+              (sum(diffs) / len(diffs), max(diffs), len([d for d in diffs if d > 0]), len(diffs)))
+    else:
+        print("no predicate has both positive and negative labels to fit")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kb_perception_source_dir', type=str, required=True,
+                        help="perception source directory with predicates and labels")
+    parser.add_argument('--kb_perception_feature_dir', type=str, required=True,
+                        help="perception feature directory for knowledge base")
+    parser.add_argument('--active_test_set', type=str, required=True,
+                        help="objects excluded from perception classifier training")
+    parser.add_argument('--behaviors', type=str, required=False,
+                        help="specify behaviors to consider")
+    parser.add_argument('--modalities', type=str, required=False,
+                        help="specify modalities to consider")
+    args = parser.parse_args()
+    for k, v in vars(args).items():
+        globals()['FLAGS_%s' % k] = v
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+__author__ = 'jesse'
+
+import sys
+sys.path.append('../')  # necessary to import PerceptionClassifiers from above directory
+
+import argparse
+import numpy as np
+import PerceptionClassifiers
+import random
+import time
+
+
+# Replays held-back labels one at a time through update_classifiers, as a live dialog would, with full refits
+# and with online updates, reporting the per-label latency of each and how far online confidences drift from
+# fully refit ones before and after the deferred refits are flushed.
+def main():
+
+    # Load parameters from command line.
+    kb_perception_source_dir = FLAGS_kb_perception_source_dir
+    kb_perception_feature_dir = FLAGS_kb_perception_feature_dir
+    active_test_set = [int(oidx) for oidx in FLAGS_active_test_set.split(',')]
+    behaviors = FLAGS_behaviors.split(',') if FLAGS_behaviors is not None else None
+    modalities = FLAGS_modalities.split(',') if FLAGS_modalities is not None else None
+    num_labels = FLAGS_num_labels
+    random.seed(FLAGS_seed)
+
+    print("main: loading perception classifiers...")
+    pcs = {}
+    for online in [False, True]:
+        pcs[online] = PerceptionClassifiers.PerceptionClassifiers(kb_perception_source_dir,
+                                                                  kb_perception_feature_dir, active_test_set,
+                                                                  behaviors=behaviors, modalities=modalities,
+                                                                  online_updates=online)
+    print("main: ... done")
+
+    # Replay labels for trained predicates on training objects.
+    pc = pcs[False]
+    candidates = [lt for lt in pc.labels
+                  if pc.classifiers[lt[0]] is not None and lt[1] not in active_test_set]
+    replay = random.sample(candidates, min(num_labels, len(candidates)))
+    if len(replay) == 0:
+        print("no labels for trained predicates to replay")
+        return
+    oidxs = [oidx for oidx in pc.oidxs if oidx not in active_test_set]
+
+    times = {}
+    for online in [False, True]:
+        times[online] = []
+        for pidx, oidx, label in replay:
+            t = time.time()
+            pcs[online].update_classifiers([], [pidx], [oidx], [label])
+            times[online].append(time.time() - t)
+
+    pidxs = sorted(set([lt[0] for lt in replay]))
+    full_confs = pcs[False].run_classifiers_batch(pidxs, oidxs)
+    online_confs = pcs[True].run_classifiers_batch(pidxs, oidxs)
+    t = time.time()
+    pcs[True].flush_pending_retrains()
+    flush_time = time.time() - t
+    flushed_confs = pcs[True].run_classifiers_batch(pidxs, oidxs)
+
+    print("replayed " + str(len(replay)) + " labels across " + str(len(pidxs)) + " predicates")
+    for online in [False, True]:
+        print(("online" if online else "full refit") + " seconds per label:\tmean %.4f\tmax %.4f" %
+              (np.mean(times[online]), np.max(times[online])))
+    print("deferred refit flush seconds:\t%.3f" % flush_time)
+    print("online conf abs diff before flush:\tmean %.4f\tmax %.4f" %
+          (np.mean(np.abs(online_confs - full_confs)), np.max(np.abs(online_confs - full_confs))))
+    print("online conf abs diff after flush:\tmean %.4f\tmax %.4f" %
+          (np.mean(np.abs(flushed_confs - full_confs)), np.max(np.abs(flushed_confs - full_confs))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kb_perception_source_dir', type=str, required=True,
+                        help="perception source directory with predicates and labels")
+    parser.add_argument('--kb_perception_feature_dir', type=str, required=True,
+                        help="perception feature directory for knowledge base")
+    parser.add_argument('--active_test_set', type=str, required=True,
+                        help="objects excluded from perception classifier training")
+    parser.add_argument('--behaviors', type=str, required=False,
+                        help="specify behaviors to consider")
+    parser.add_argument('--modalities', type=str, required=False,
+                        help="specify modalities to consider")
+    parser.add_argument('--num_labels', type=int, required=False, default=20,
+                        help="number of existing labels to replay as new dialog labels")
+    parser.add_argument('--seed', type=int, required=False, default=0,
+                        help="random seed for choosing labels to replay")
+    args = parser.parse_args()
+    for k, v in vars(args).items():
+        globals()['FLAGS_%s' % k] = v
+    main()
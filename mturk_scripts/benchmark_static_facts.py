@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+__author__ = 'jesse'
+
+import sys
+sys.path.append('../')  # necessary to import KnowledgeBase from above directory
+sys.path.append('../../tsp/')  # necessary to unpickle the CKYParser
+
+import argparse
+import itertools
+import KnowledgeBase
+import os
+import pickle
+import random
+import tempfile
+import time
+import tracemalloc
+
+
+# Reads a facts file the way KnowledgeBase did before commutative facts were stored canonically, adding every
+# argument permutation of commutative facts, and returns the set of fact tuples.
+def extract_permuted_facts(fn, ontology):
+    static_facts = set()
+    with open(fn, 'r') as f:
+        for line in f.readlines():
+            l = line.strip()
+            if len(l) == 0 or l[0] == '#' or l.count('(') != 1 or l.count(')') != 1:
+                continue
+            p = l.split('(')
+            pred = p[0]
+            args = [a.strip() for a in p[1].strip(')').split(',')]
+            if ontology.preds.index(pred) in ontology.commutative:
+                for perm_idxs in itertools.permutations(range(len(args))):
+                    static_facts.add(tuple([pred] + [args[idx] for idx in perm_idxs]))
+            else:
+                static_facts.add(tuple([pred] + args))
+    return static_facts
+
+
+# Writes a large synthetic facts file of commutative facts over the atoms of a real facts file, then compares
+# the load time and memory of storing them canonically against materializing every argument permutation.
+def main():
+
+    # Load parameters from command line.
+    parser_fn = FLAGS_parser_fn
+    kb_static_facts_fn = FLAGS_kb_static_facts_fn
+    kb_perception_source_dir = FLAGS_kb_perception_source_dir
+    kb_perception_feature_dir = FLAGS_kb_perception_feature_dir
+    active_test_set = [int(oidx) for oidx in FLAGS_active_test_set.split(',')]
+    num_facts = FLAGS_num_facts
+    arity = FLAGS_arity
+    random.seed(FLAGS_seed)
+
+    print("main: loading parser and knowledge base...")
+    with open(parser_fn, 'rb') as f:
+        p = pickle.load(f)
+    kb = KnowledgeBase.KnowledgeBase(kb_static_facts_fn, kb_perception_source_dir, kb_perception_feature_dir,
+                                     active_test_set, p.ontology)
+    print("main: ... done")
+
+    # Synthesize distinct commutative facts over the atoms that appear as arguments of the real facts, whose
+    # ontology idxs are mapped back to their names to be written out.
+    commutative_preds = sorted([p.ontology.preds[idx] for idx in kb.commutative_pred_idxs])
+    atoms = sorted(set([p.ontology.preds[a] for f in kb.static_facts for a in f[1:]]))
+    if len(commutative_preds) == 0 or len(atoms) < arity:
+        print("ontology has no commutative predicates or facts have too few atoms to synthesize from")
+        return
+    facts = set()
+    for _ in range(num_facts * 10):
+        if len(facts) == num_facts:
+            break
+        facts.add(tuple([random.choice(commutative_preds)] + sorted(random.sample(atoms, arity))))
+    fd, synthetic_fn = tempfile.mkstemp(suffix=".txt")
+    with os.fdopen(fd, 'w') as f:
+        for fact in facts:
+            f.write(fact[0] + '(' + ','.join(fact[1:]) + ")\n")
+    print("wrote " + str(len(facts)) + " synthetic " + str(arity) + "-ary commutative facts to " + synthetic_fn)
+
+    print("STORAGE\t\tLOAD_S\tTUPLES\tPEAK_MB")
+    tracemalloc.start()
+    t = time.time()
+    permuted = extract_permuted_facts(synthetic_fn, p.ontology)
+    permuted_time = time.time() - t
+    _, permuted_peak = tracemalloc.get_traced_memory()
+    print("permutations\t%.3f\t%d\t%.1f" % (permuted_time, len(permuted), permuted_peak / 1048576.))
+    del permuted
+
+    tracemalloc.reset_peak()
+    t = time.time()
+    kb.extract_facts_from_file(synthetic_fn)
+    canonical_time = time.time() - t
+    _, canonical_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("canonical\t%.3f\t%d\t%.1f" % (canonical_time, len(kb.static_facts), canonical_peak / 1048576.))
+    os.remove(synthetic_fn)
+    if os.path.isfile(KnowledgeBase.get_compiled_facts_fn(synthetic_fn)):
+        os.remove(KnowledgeBase.get_compiled_facts_fn(synthetic_fn))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parser_fn', type=str, required=True,
+                        help="a parser pickle whose ontology the facts are validated against")
+    parser.add_argument('--kb_static_facts_fn', type=str, required=True,
+                        help="static facts file whose atoms synthetic facts are drawn from")
+    parser.add_argument('--kb_perception_source_dir', type=str, required=True,
+                        help="perception source directory for knowledge base")
+    parser.add_argument('--kb_perception_feature_dir', type=str, required=True,
+                        help="perception feature directory for knowledge base")
+    parser.add_argument('--active_test_set', type=str, required=True,
+                        help="objects excluded from perception classifier training")
+    parser.add_argument('--num_facts', type=int, required=False, default=100000,
+                        help="number of synthetic facts to write")
+    parser.add_argument('--arity', type=int, required=False, default=3,
+                        help="number of arguments of each synthetic fact")
+    parser.add_argument('--seed', type=int, required=False, default=0,
+                        help="random seed for synthesizing facts")
+    args = parser.parse_args()
+    for k, v in vars(args).items():
+        globals()['FLAGS_%s' % k] = v
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+__author__ = 'jesse'
+
+import sys
+sys.path.append('../')  # necessary to import KnowledgeBase from above directory
+sys.path.append('../../tsp/')  # necessary to unpickle the CKYParser
+
+import argparse
+import KnowledgeBase
+import pickle
+
+
+# Validates a static facts file against a parser's ontology once and writes the compiled form agent processes
+# load at startup, so the first agent after a facts or ontology change does not pay to parse it.
+def main():
+
+    # Load parameters from command line.
+    parser_fn = FLAGS_parser_fn
+    kb_static_facts_fn = FLAGS_kb_static_facts_fn
+
+    print("main: loading parser from file...")
+    with open(parser_fn, 'rb') as f:
+        p = pickle.load(f)
+    print("main: ... done")
+
+    print("main: compiling static facts...")
+    facts = KnowledgeBase.compile_static_facts(kb_static_facts_fn, p.ontology)
+    print("main: ... done; wrote " + str(sum([len(facts[arity]) for arity in facts])) + " facts to " +
+          KnowledgeBase.get_compiled_facts_fn(kb_static_facts_fn))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parser_fn', type=str, required=True,
+                        help="a parser pickle whose ontology the facts are validated against")
+    parser.add_argument('--kb_static_facts_fn', type=str, required=True,
+                        help="static facts file to compile")
+    args = parser.parse_args()
+    for k, v in vars(args).items():
+        globals()['FLAGS_%s' % k] = v
+    main()
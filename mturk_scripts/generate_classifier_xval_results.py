@@ -40,7 +40,7 @@ def get_results_for_behaviors_and_modalities(kb_static_facts_fn, kb_perception_s
 
             # Blind the perception classifier to these oidxs, get annotator label, and retrain classifier.
             old_labels = g.kb.pc.labels[:]
-            g.kb.pc.labels = [lt for lt in g.kb.pc.labels if lt[0] != pidx or lt[1] in train_fold]
+            g.kb.pc.set_labels([lt for lt in g.kb.pc.labels if lt[0] != pidx or lt[1] in train_fold])
             g.kb.pc.train_classifiers([pidx])
 
             # Get held-out result and update the appropriate cell in the confusion matrix.
@@ -61,7 +61,7 @@ def get_results_for_behaviors_and_modalities(kb_static_facts_fn, kb_perception_s
                     num_labeled_objs += 1
 
             # Re-assign old labels.
-            g.kb.pc.labels = old_labels
+            g.kb.pc.set_labels(old_labels)
 
         # Retrain original classifier.
         g.kb.pc.train_classifiers([pidx])
@@ -31,6 +31,13 @@ def main():
     training_log_fn = FLAGS_training_log_fn
     full_pairs_log_fn = FLAGS_full_pairs_log_fn
     epochs = FLAGS_epochs
+    training_workers = FLAGS_training_workers
+    grounding_workers = FLAGS_grounding_workers
+    induction_workers = FLAGS_induction_workers
+    induction_pair_timeout = FLAGS_induction_pair_timeout
+    induction_pair_retries = FLAGS_induction_pair_retries
+    kappa_mode = FLAGS_kappa_mode
+    classifier_backend = FLAGS_classifier_backend
     use_condor = FLAGS_use_condor
     condor_target_dir = FLAGS_condor_target_dir
     condor_parser_script_dir = FLAGS_condor_parser_script_dir
@@ -96,7 +103,8 @@ def main():
     # Instantiate a new grounder with the base parser and with perception source at the target dir.
     print("main: instantiating grounder...")
     g = KBGrounder.KBGrounder(p, kb_static_facts_fn, kb_perception_source_target_dir,
-                              kb_perception_feature_dir, active_test_set)
+                              kb_perception_feature_dir, active_test_set, training_workers=training_workers,
+                              kappa_mode=kappa_mode, classifier_backend=classifier_backend)
     print("main: ... done")
 
     # Instantiate vestigial input/output
@@ -106,7 +114,7 @@ def main():
 
     # Instantiate an Agent.
     print("main: instantiating Agent...")
-    a = Agent.Agent(p, g, io, None)
+    a = Agent.Agent(p, g, io, None, grounding_workers=grounding_workers)
     print("main: ... done")
 
     # Open logfile.
@@ -286,6 +294,7 @@ def main():
 
     # Iterate inducing new pairs using most up-to-date parser and training for single epoch.
     # Each of these stages can be distributed over the UT Condor system for more linear-time computation.
+    # Getting grounding->semantics pairs can instead be distributed over a local pool of induction workers.
     print("main: training parser by alternative grounding->semantics and semantics->parser training steps...")
     fplfn = open(full_pairs_log_fn, 'w')
     for epoch in range(epochs):
@@ -295,7 +304,8 @@ def main():
             print("main: ... getting utterance/semantic form pairs from induced utterance/grounding pairs...")
             utterance_semantic_grounding_triples = a.get_semantic_forms_for_induced_pairs(
                 1, 10, verbose=1, use_condor=use_condor, condor_target_dir=condor_target_dir,
-                condor_script_dir=condor_grounder_script_dir)
+                condor_script_dir=condor_grounder_script_dir, induction_workers=induction_workers,
+                induction_pair_timeout=induction_pair_timeout, induction_pair_retries=induction_pair_retries)
             print ("main: ...... got " + str(len(utterance_semantic_grounding_triples)) + " utterance/semantics " +
                    "pairs from induced utterance/grounding pairs" +
                    "(%.2f" % (len(utterance_semantic_grounding_triples) / float(len(a.induced_utterance_grounding_pairs))) + ")")
@@ -399,6 +409,20 @@ if __name__ == '__main__':
                         help="logfile to write utterance/semantic/grounding triples to")
     parser.add_argument('--epochs', type=int, required=False, default=10,
                         help="how many times to iterate over grounding/parsing data")
+    parser.add_argument('--training_workers', type=int, required=False, default=1,
+                        help="processes to spread perception classifier retraining across")
+    parser.add_argument('--grounding_workers', type=int, required=False, default=1,
+                        help="processes to ground induced pairs' parses in while later parses are produced")
+    parser.add_argument('--induction_workers', type=int, required=False, default=1,
+                        help="local processes to distribute induced pairs across when not using condor")
+    parser.add_argument('--induction_pair_timeout', type=int, required=False, default=600,
+                        help="seconds each induced pair may take in a local induction worker")
+    parser.add_argument('--induction_pair_retries', type=int, required=False, default=1,
+                        help="times to retry an induced pair that fails or times out in a local induction worker")
+    parser.add_argument('--kappa_mode', type=str, required=False, default='exact',
+                        help="'exact' or 'support' leave-one-object-out kappa estimation during retraining")
+    parser.add_argument('--classifier_backend', type=str, required=False, default='svc',
+                        help="one of 'svc', 'linear_svm', 'logistic', or 'centroid' perception classifiers")
     parser.add_argument('--use_condor', type=int, required=False, default=0,
                         help="whether to invoke the UT condor system to distribute parser training")
     parser.add_argument('--condor_target_dir', type=str, required=False, default=None,
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+__author__ = 'jesse'
+
+import os
+import pickle
+import pytest
+import sys
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(repo_dir)  # necessary to import KBGrounder from above directory
+sys.path.append(os.path.join(repo_dir, '..', 'tsp'))  # necessary to import CKYParser from above directory
+
+CKYParser = pytest.importorskip('CKYParser')
+Lexicon = pytest.importorskip('Lexicon')
+Ontology = pytest.importorskip('Ontology')
+import KBGrounder
+
+parsing_resources_dir = os.path.join(repo_dir, 'ispy_setting', 'parsing_resources')
+
+
+# Returns a grounder over the ispy ontology with the given static facts and a single object with no perception
+# labels, built in tmp_dir.
+def make_grounder(tmp_dir, facts, **kwargs):
+    ont = Ontology.Ontology(os.path.join(parsing_resources_dir, 'ont.txt'))
+    lex = Lexicon.Lexicon(ont, os.path.join(parsing_resources_dir, 'mturk_lex.txt'))
+    p = CKYParser.CKYParser(ont, lex)
+
+    facts_fn = os.path.join(tmp_dir, 'facts.txt')
+    with open(facts_fn, 'w') as f:
+        f.write("\n".join(facts) + "\n")
+    source_dir = os.path.join(tmp_dir, 'source')
+    feature_dir = os.path.join(tmp_dir, 'features')
+    os.makedirs(source_dir)
+    os.makedirs(feature_dir)
+    with open(os.path.join(feature_dir, 'oidxs.pickle'), 'wb') as f:
+        pickle.dump([0], f)
+    with open(os.path.join(feature_dir, 'features.pickle'), 'wb') as f:
+        pickle.dump({0: {'look': {'color': [[0.0, 1.0]]}}}, f)
+
+    return KBGrounder.KBGrounder(p, facts_fn, source_dir, feature_dir, [0],
+                                 behaviors=['look'], modalities=['color'], **kwargs)
+
+
+# Returns the names of the atoms the groundings of a semantic form str are.
+def ground_to_names(g, s):
+    gs = g.ground_semantic_tree(g.parser.lexicon.read_semantic_form_from_str(s, None, None, []))
+    return sorted([g.parser.ontology.preds[t.idx] for t, _, _ in gs])
+
+
+facts = ['office(3508)', 'office(3512)', 'possesses(p, 3508)', 'possesses(r, 3512)']
+
+
+# 'the' grounds to the one assignment that makes its argument True, however many make it False.
+@pytest.mark.parametrize('engine', ['recursive', 'vectorized'])
+def test_the_grounds_to_unique_true_assignment(tmp_path, engine):
+    g = make_grounder(str(tmp_path), facts, engine=engine)
+    assert ground_to_names(g, 'the_l(lambda x:l.(and(office(x), possesses(r, x))))') == ['3512']
+    assert ground_to_names(g, 'the_l(lambda x:l.(office(x)))') == []  # two offices
+    assert ground_to_names(g, 'a_l(lambda x:l.(office(x)))') == ['3508', '3512']
+
+
+# As a 'singleton', 'the' grounds only if its argument has one grounding, so other rooms' False groundings count.
+@pytest.mark.parametrize('engine', ['recursive', 'vectorized'])
+def test_the_singleton_counts_false_groundings(tmp_path, engine):
+    g = make_grounder(str(tmp_path), facts, engine=engine, the_grounding='singleton')
+    assert ground_to_names(g, 'the_l(lambda x:l.(and(office(x), possesses(r, x))))') == []
+    assert ground_to_names(g, 'a_l(lambda x:l.(office(x)))') == ['3508', '3512']
+
+
+def test_the_grounding_is_validated(tmp_path):
+    with pytest.raises(ValueError):
+        make_grounder(str(tmp_path), facts, the_grounding='first')